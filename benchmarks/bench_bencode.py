@@ -0,0 +1,371 @@
+"""
+Benchmark reading and writing bencoded nREPL traffic.
+
+Runs without Sublime Text:
+
+    python benchmarks/bench_bencode.py
+
+To record the results as a baseline and later compare against it:
+
+    python benchmarks/bench_bencode.py --baseline bencode.json
+    python benchmarks/bench_bencode.py --compare bencode.json
+
+When comparing, exits with a non-zero status if any benchmark is slower than
+the baseline by more than the given tolerance.
+"""
+
+import argparse
+import importlib.util
+import io
+import json
+import os
+import platform
+import sys
+import time
+
+
+def load_bencode():
+    # Load the module straight from its file so that we don't need to import
+    # the Tutkain package, which imports sublime.
+    path = os.path.join(os.path.dirname(__file__), "..", "src", "repl", "bencode.py")
+    spec = importlib.util.spec_from_file_location("bencode", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+bencode = load_bencode()
+
+# The number of bytes the client reads from the socket at once.
+CHUNK_SIZE = 65536
+
+
+def out_messages(n):
+    """Many tiny stdout messages, like a loop that calls println."""
+    return [
+        {"id": i, "session": "6b5e2e1c-10fa-4c0b-8f83-3f6a5c0c7e0a", "out": f"{i}\n"}
+        for i in range(n)
+    ]
+
+
+def value_messages(n):
+    """A few large pretty-printed evaluation results."""
+    row = '{:id 1234, :name "Ångström", :tags #{:a :b :c}, :score 3.14159}\n'
+    value = "[" + row * 16384 + "]\n"
+
+    return [
+        {
+            "id": i,
+            "session": "6b5e2e1c-10fa-4c0b-8f83-3f6a5c0c7e0a",
+            "ns": "user",
+            "value": value,
+        }
+        for i in range(n)
+    ]
+
+
+def nested_var_meta(depth):
+    meta = {"line": 1, "column": 1, "file": "app/core_test.clj", "name": "leaf"}
+
+    for i in range(depth):
+        meta = {"line": i, "column": 1, "name": f"level-{i}", "meta": meta}
+
+    return meta
+
+
+def test_messages(n):
+    """Results of the tutkain/test op, with deeply nested var metadata."""
+
+    def result(i, type):
+        return {
+            "type": type,
+            "line": i,
+            "expected": "(= 3 (+ 1 1))",
+            "actual": "(not (= 3 2))",
+            "var-meta": nested_var_meta(16),
+        }
+
+    return [
+        {
+            "id": i,
+            "session": "6b5e2e1c-10fa-4c0b-8f83-3f6a5c0c7e0a",
+            "pass": [result(j, "pass") for j in range(32)],
+            "fail": [result(j, "fail") for j in range(8)],
+            "error": [result(j, "error") for j in range(4)],
+        }
+        for i in range(n)
+    ]
+
+
+def completion_messages(n):
+    """Responses to the completions op."""
+    return [
+        {
+            "id": i,
+            "session": "6b5e2e1c-10fa-4c0b-8f83-3f6a5c0c7e0a",
+            "completions": [
+                {
+                    "candidate": f"clojure.core/fn-{j}",
+                    "ns": "clojure.core",
+                    "type": "function",
+                }
+                for j in range(512)
+            ],
+            "status": ["done"],
+        }
+        for i in range(n)
+    ]
+
+
+def op_messages(n):
+    """Ops the client sends, with the values Session.op() adds into evals."""
+    pprint = bencode.Fragment("tutkain.nrepl.util.pprint/pprint")
+    pprint_options = bencode.Fragment({"width": 100})
+    true = bencode.Fragment("true")
+    session = "6b5e2e1c-10fa-4c0b-8f83-3f6a5c0c7e0a"
+
+    def op(i):
+        if i % 3 == 0:
+            return {"op": "completions", "prefix": "ma", "ns": "app.core"}
+        elif i % 3 == 1:
+            return {"op": "lookup", "sym": "map", "ns": "app.core"}
+        else:
+            return {
+                "op": "eval",
+                "code": "(+ 1 2)",
+                "ns": "app.core",
+                "file": "/home/user/app/src/app/core.clj",
+                "nrepl.middleware.print/print": pprint,
+                "nrepl.middleware.print/options": pprint_options,
+                "nrepl.middleware.caught/print?": true,
+                "nrepl.middleware.print/stream?": true,
+            }
+
+    return [dict(op(i), session=session, id=i) for i in range(n)]
+
+
+def deep_messages(n):
+    """Tap values nested deeper than the default recursion limit."""
+
+    def nested(depth):
+        value = "leaf"
+
+        for i in range(depth):
+            value = {"k": value} if i % 2 else [i, value]
+
+        return value
+
+    return [{"id": i, "tap": nested(2000)} for i in range(n)]
+
+
+TRAFFIC = {
+    "out": lambda scale: out_messages(20000 * scale),
+    "value": lambda scale: value_messages(4 * scale),
+    "test": lambda scale: test_messages(40 * scale),
+    "completions": lambda scale: completion_messages(40 * scale),
+    "deep": lambda scale: deep_messages(20 * scale),
+    "ops": lambda scale: op_messages(20000 * scale),
+}
+
+
+def encode(messages):
+    buf = io.BytesIO()
+
+    for message in messages:
+        bencode.write(buf, message)
+
+    return buf.getvalue()
+
+
+def bench_write(messages, data):
+    buf = io.BytesIO()
+    start = time.perf_counter()
+
+    for message in messages:
+        bencode.write(buf, message)
+
+    return time.perf_counter() - start
+
+
+def bench_encoder(messages, data):
+    encoder = bencode.Encoder()
+    start = time.perf_counter()
+
+    for message in messages:
+        encoder.clear()
+        encoder.encode(message)
+
+    return time.perf_counter() - start
+
+
+def bench_read(messages, data):
+    buf = io.BufferedReader(io.BytesIO(data))
+    start = time.perf_counter()
+
+    for _ in messages:
+        bencode.read(buf)
+
+    return time.perf_counter() - start
+
+
+def bench_decoder(messages, data, decoder=None):
+    decoder = decoder or bencode.Decoder()
+    count = 0
+    start = time.perf_counter()
+
+    for offset in range(0, len(data), CHUNK_SIZE):
+        end = offset + CHUNK_SIZE
+
+        for _ in decoder.feed(data[offset:end]):
+            count += 1
+
+    elapsed = time.perf_counter() - start
+    assert count == len(messages)
+    return elapsed
+
+
+def bench_lazy_decoder(messages, data):
+    decoder = bencode.Decoder(lazy_keys=bencode.PAYLOAD_KEYS)
+    return bench_decoder(messages, data, decoder)
+
+
+BENCHMARKS = {
+    "write": bench_write,
+    "encoder": bench_encoder,
+    "read": bench_read,
+    "decoder": bench_decoder,
+    "lazy": bench_lazy_decoder,
+}
+
+
+def run(traffic, benchmarks, scale, repeat):
+    results = {}
+
+    for traffic_name in traffic:
+        messages = TRAFFIC[traffic_name](scale)
+        data = encode(messages)
+
+        for benchmark_name in benchmarks:
+            benchmark = BENCHMARKS[benchmark_name]
+            elapsed = min(benchmark(messages, data) for _ in range(repeat))
+
+            results[f"{benchmark_name}/{traffic_name}"] = {
+                "messages": len(messages),
+                "bytes": len(data),
+                "seconds": elapsed,
+                "messages_per_second": len(messages) / elapsed,
+                "megabytes_per_second": len(data) / elapsed / 1024 / 1024,
+                "microseconds_per_message": elapsed / len(messages) * 1000000,
+            }
+
+    return results
+
+
+def report(results, baseline=None):
+    header = f"{'benchmark':<24} {'msgs/s':>12} {'MB/s':>9} {'µs/msg':>10}"
+
+    if baseline:
+        header += f" {'change':>8}"
+
+    print(header)
+
+    for name, result in results.items():
+        line = (
+            f"{name:<24} "
+            f"{result['messages_per_second']:>12.0f} "
+            f"{result['megabytes_per_second']:>9.2f} "
+            f"{result['microseconds_per_message']:>10.2f}"
+        )
+
+        if baseline and name in baseline:
+            line += f" {change(baseline[name], result):>+8.1%}"
+
+        print(line)
+
+
+def change(before, after):
+    """Return the relative change in throughput between two results."""
+    return after["megabytes_per_second"] / before["megabytes_per_second"] - 1
+
+
+def regressions(baseline, results, tolerance):
+    return [
+        name
+        for name, result in results.items()
+        if name in baseline and change(baseline[name], result) < -tolerance
+    ]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+
+    parser.add_argument(
+        "--traffic",
+        nargs="+",
+        choices=TRAFFIC.keys(),
+        default=list(TRAFFIC.keys()),
+        help="the kinds of traffic to benchmark",
+    )
+
+    parser.add_argument(
+        "--benchmark",
+        nargs="+",
+        choices=BENCHMARKS.keys(),
+        default=list(BENCHMARKS.keys()),
+        help="the operations to benchmark",
+    )
+
+    parser.add_argument(
+        "--scale", type=int, default=1, help="multiply the amount of traffic by this"
+    )
+
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="report the best of this many runs"
+    )
+
+    parser.add_argument("--baseline", help="write the results into this JSON file")
+    parser.add_argument("--compare", help="compare the results to this JSON file")
+
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="the slowdown to allow when comparing, as a fraction",
+    )
+
+    args = parser.parse_args(argv)
+
+    baseline = None
+
+    if args.compare:
+        with open(args.compare, "r") as file:
+            baseline = json.load(file)["results"]
+
+    results = run(args.traffic, args.benchmark, args.scale, args.repeat)
+    report(results, baseline)
+
+    if args.baseline:
+        with open(args.baseline, "w") as file:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "scale": args.scale,
+                    "results": results,
+                },
+                file,
+                indent=2,
+            )
+
+    if baseline:
+        slower = regressions(baseline, results, args.tolerance)
+
+        if slower:
+            print(f"Slower than baseline: {', '.join(slower)}", file=sys.stderr)
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
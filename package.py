@@ -3,9 +3,12 @@ import collections
 import glob
 import json
 import os
-import queue
+import re
+import shutil
+import socket
+import stat
+import time
 import sublime
-import uuid
 
 from sublime_plugin import (
     EventListener,
@@ -27,18 +30,59 @@ from .src import inline
 from .src import paredit
 from .src import namespace
 from .src import test
+from .src.progress import ProgressBar
+from .src.repl import capabilities
+from .src.repl import engine
 from .src.repl import info
+from .src.repl import jobs
 from .src.repl import history
+from .src.repl import prepl
 from .src.repl import tap
 from .src.repl.client import Client
+from .src.repl.connection import SendQueue
+from .src.repl.handshake import Handshake
+from .src.repl.printer import (
+    Folds,
+    Frame,
+    Highlights,
+    Mailbox,
+    Printer,
+    kind_of,
+    take,
+)
 from .src.repl.session import Session
+from .src.repl.transcript import Transcript
 
 from .src.log import log, start_logging, stop_logging
 
 
+# How long, in seconds, to wait for the server to respond to ops like
+# completions and lookup before forgetting about them.
+PLUGIN_OP_TIMEOUT = 10
+
+
+# Once a REPL view holds more than output_view_max_size characters, trim it
+# down to this fraction of the maximum size, so that we trim in large blocks
+# instead of after every append.
+OUTPUT_VIEW_TRIM_TO = 0.75
+
+# The stdout and stderr highlights of every REPL view.
+highlights = Highlights(sublime.Region, flags=sublime.DRAW_NO_OUTLINE)
+
+# The collapsed results of every REPL view.
+folds = Folds()
+
+# The key of the phantoms that stand in for collapsed results.
+FOLD_PHANTOM_KEY = "tutkain/fold"
+
 state = {
     "active_repl_view": collections.defaultdict(dict),
     "client_by_view": collections.defaultdict(dict),
+    # The user session of every REPL view that shares its client with a REPL
+    # view in another window, or None if the server hasn't cloned it yet.
+    "user_session_by_view": {},
+    # The transcript of every REPL view.
+    "transcript_by_view": {},
 }
 
 
@@ -100,6 +144,14 @@ def make_color_scheme(cache_dir):
                     )
 
 
+def capabilities_cache():
+    if state.get("capabilities_cache") is None:
+        path = os.path.join(sublime.cache_path(), "Tutkain", "capabilities.json")
+        state["capabilities_cache"] = capabilities.Cache(path)
+
+    return state["capabilities_cache"]
+
+
 def settings():
     return sublime.load_settings("Tutkain.sublime-settings")
 
@@ -111,6 +163,10 @@ def plugin_loaded():
 
     cache_dir = os.path.join(sublime.cache_path(), "Tutkain")
 
+    # Closing a REPL view deletes its transcript, but if Sublime Text quit
+    # before we got to close it, the transcript is still there.
+    shutil.rmtree(os.path.join(cache_dir, "transcripts"), ignore_errors=True)
+
     make_color_scheme(cache_dir)
     preferences.add_on_change("Tutkain", lambda: make_color_scheme(cache_dir))
 
@@ -121,6 +177,8 @@ def plugin_unloaded():
     for window in sublime.windows():
         window.run_command("tutkain_disconnect")
 
+    engine.stop()
+
     view = sublime.active_window().active_view()
     view and inline.clear(view)
 
@@ -157,9 +215,98 @@ def get_active_view_client(window):
     return get_view_client(get_active_repl_view(window))
 
 
+def get_view_sessions(view):
+    client = get_view_client(view)
+
+    if client:
+        sessions = client.sessions_by_owner
+
+        if view.id() in state["user_session_by_view"]:
+            sessions = dict(sessions, user=state["user_session_by_view"][view.id()])
+
+        return sessions
+
+
 def get_active_view_sessions(window):
-    client = get_active_view_client(window)
-    return client and client.sessions_by_owner
+    return get_view_sessions(get_active_repl_view(window))
+
+
+def find_client(address):
+    """Return the client another REPL view already uses to talk to the nREPL
+    server at the given address (see Client.address), if any."""
+    for client in state["client_by_view"].values():
+        if (
+            not isinstance(client, prepl.PreplClient)
+            and client.address() == address
+            and not client.stop_event.is_set()
+            and not client.connection.closed
+        ):
+            return client
+
+
+def get_client_views(client):
+    return [
+        sublime.View(view_id)
+        for view_id, view_client in state["client_by_view"].items()
+        if view_client is client
+    ]
+
+
+def get_client_windows(client):
+    windows = (view.window() for view in get_client_views(client))
+    return [window for window in windows if window]
+
+
+def get_primary_view(client):
+    """Return the REPL view whose user session is the user session of client,
+    if any: the only view that uses client that doesn't have a user session
+    in state["user_session_by_view"]."""
+    for view in get_client_views(client):
+        if view.id() not in state["user_session_by_view"]:
+            return view
+
+
+def hand_over(client, view):
+    """Let another REPL view that uses client take over for view, which is
+    closing.
+
+    The sessions of view print into the view that takes over. If view was the
+    primary view of client, the user session of the view that takes over
+    becomes the user session of client."""
+    views = get_client_views(client)
+    successor = get_primary_view(client)
+
+    if not views:
+        return
+    elif successor is None:
+        successor = views[0]
+        user = state["user_session_by_view"].pop(successor.id())
+
+        if user:
+            client.sessions_by_owner["user"] = user
+        else:
+            # The server hasn't cloned the user session of the successor yet;
+            # clone_user_session registers it once it has.
+            client.sessions_by_owner.pop("user", None)
+
+    # Leave the user session of view be: it's closing.
+    for session in list(client.sessions.values()):
+        if session.view == view and session.owner != "user":
+            session.view = successor
+
+
+def start_transcript(client, view):
+    path = os.path.join(
+        sublime.cache_path(),
+        "Tutkain",
+        "transcripts",
+        f"{client.id()}-{view.id()}.txt",
+    )
+
+    state["transcript_by_view"][view.id()] = Transcript(path)
+
+    # Where the text of the view starts in the transcript, in characters.
+    view.settings().set("tutkain_transcript_start", 0)
 
 
 def get_session_by_owner(window, owner):
@@ -171,6 +318,158 @@ def forget_repl_view(view):
     if view and view.id() in state["client_by_view"]:
         del state["client_by_view"][view.id()]
 
+    if view:
+        state["user_session_by_view"].pop(view.id(), None)
+        transcript = state["transcript_by_view"].pop(view.id(), None)
+        transcript and transcript.delete()
+        highlights.clear(view)
+        folds.forget(view)
+
+
+def show_fold(view, fold, point):
+    """Show a phantom under the line at point that says how many lines fold
+    holds. Clicking the phantom expands the fold."""
+    lines = len(fold)
+    html = """<a href="expand">… {} more line{}</a>""".format(
+        lines, "" if lines == 1 else "s"
+    )
+
+    fold.phantom = view.add_phantom(
+        FOLD_PHANTOM_KEY,
+        sublime.Region(point, point),
+        html,
+        sublime.LAYOUT_BLOCK,
+        on_navigate=lambda href: view.run_command(
+            "tutkain_expand_result", {"fold": fold.id}
+        ),
+    )
+
+
+def update_fold(view, fold):
+    """Update the number of lines the phantom of fold shows."""
+    regions = view.query_phantom(fold.phantom)
+    view.erase_phantom_by_id(fold.phantom)
+
+    if regions:
+        show_fold(view, fold, regions[0].begin())
+    else:
+        folds.remove(fold)
+
+
+class TutkainExpandResultCommand(TextCommand):
+    """Show the next result_max_lines lines of a collapsed result."""
+
+    def run(self, edit, fold):
+        view = self.view
+        fold = folds.get(fold)
+        regions = fold and view.query_phantom(fold.phantom)
+
+        if not regions:
+            return
+
+        view.erase_phantom_by_id(fold.phantom)
+        # The phantom is at the end of the last line of the result the view
+        # shows.
+        point = regions[0].begin() + 1
+        characters = fold.take(settings().get("result_max_lines") or len(fold))
+
+        view.set_read_only(False)
+        view.insert(edit, point, characters)
+        view.set_read_only(True)
+
+        if len(fold) or folds.is_open(fold):
+            show_fold(view, fold, point + len(characters) - 1)
+        else:
+            folds.remove(fold)
+
+
+class TutkainTrimOutputViewCommand(TextCommand):
+    """Erase the oldest lines of a REPL view, so that the view holds at most
+    size characters. The transcript of the view still has them.
+
+    If appending to the transcript has ever failed, leave the view be: it's the
+    only place some of its output is in."""
+
+    def run(self, edit, size):
+        view = self.view
+        transcript = state["transcript_by_view"].get(view.id())
+
+        if transcript and not transcript.failed and view.size() > size:
+            end = view.full_line(view.size() - size).end()
+            log.debug({"event": "output-view/trim", "characters": end})
+            folds.trim(view, end)
+            view.set_read_only(False)
+            view.erase(edit, sublime.Region(0, end))
+            view.set_read_only(True)
+            highlights.trim(view)
+
+            start = view.settings().get("tutkain_transcript_start", 0)
+            view.settings().set("tutkain_transcript_start", start + end)
+
+
+class TutkainSearchTranscriptCommand(WindowCommand):
+    """Search the transcript of the active REPL view for evaluations whose code
+    or output matches a regular expression. Choose one to select it in the REPL
+    view, or, if the REPL view no longer has it, to open it in a new view."""
+
+    def show(self, view, transcript, evaluation):
+        start = view.settings().get("tutkain_transcript_start", 0)
+        begin = evaluation.chars - start
+        end = evaluation.chars_end - start
+
+        # Expanding a collapsed result moves the evaluations that come after
+        # it, so make sure the view still has the code where we expect it.
+        code = transcript.read(evaluation.offset, evaluation.entries[0].length)
+
+        if (
+            begin >= 0
+            and end <= view.size()
+            and view.substr(sublime.Region(begin, begin + len(code))) == code
+        ):
+            self.window.focus_view(view)
+            view.sel().clear()
+            view.sel().add(sublime.Region(begin, end))
+            view.show_at_center(begin)
+        else:
+            extract = self.window.new_file()
+            extract.set_name("REPL Transcript")
+            extract.set_scratch(True)
+            extract.assign_syntax("Clojure (Tutkain).sublime-syntax")
+            print_characters(extract, transcript.extract(evaluation))
+
+    def search(self, view, transcript, pattern):
+        try:
+            evaluations = transcript.search(pattern)
+        except re.error as error:
+            self.window.status_message(f"ERR: Invalid regular expression: {error}")
+            return
+
+        if not evaluations:
+            self.window.status_message(f"No evaluations match {pattern}.")
+        else:
+            self.window.show_quick_panel(
+                [transcript.preview(evaluation) for evaluation in evaluations],
+                lambda i: i != -1 and self.show(view, transcript, evaluations[i]),
+                flags=sublime.MONOSPACE_FONT,
+            )
+
+    def run(self):
+        view = get_active_repl_view(self.window)
+        transcript = view and state["transcript_by_view"].get(view.id())
+
+        if not transcript:
+            self.window.status_message("ERR: Not connected to a REPL.")
+        else:
+            self.window.show_input_panel(
+                "Search Transcript: ",
+                "",
+                lambda pattern: sublime.set_timeout_async(
+                    lambda: self.search(view, transcript, pattern)
+                ),
+                None,
+                None,
+            )
+
 
 class TutkainClearOutputViewCommand(WindowCommand):
     def clear_view(self, view):
@@ -179,8 +478,16 @@ class TutkainClearOutputViewCommand(WindowCommand):
             view.run_command("select_all")
             view.run_command("right_delete")
             view.set_read_only(True)
+            highlights.clear(view)
+            view.erase_phantoms(FOLD_PHANTOM_KEY)
+            folds.forget(view)
             inline.clear(self.window.active_view())
 
+            transcript = state["transcript_by_view"].get(view.id())
+
+            if transcript:
+                view.settings().set("tutkain_transcript_start", transcript.chars)
+
     def run(self):
         session = get_session_by_owner(self.window, "user")
 
@@ -275,6 +582,73 @@ class TutkainEvaluateFormCommand(TextCommand):
                     )
 
 
+class TutkainEvaluateFormInBackgroundCommand(TutkainEvaluateFormCommand):
+    """Evaluate a form in a background session, so that you can keep using the
+    user session while the evaluation runs."""
+
+    def start(self, client, session, op):
+        session.output({"in": op["code"], "ns": op["ns"]})
+        client.jobs.start(session, op, session.output)
+
+    def run(self, edit, scope="outermost", ignore={"comment"}):
+        window = self.view.window()
+        client = get_active_view_client(window)
+        user = get_session_by_owner(window, "user")
+
+        if user is None:
+            window.status_message("ERR: Not connected to a REPL.")
+        elif not user.supports("clone"):
+            window.status_message("ERR: The REPL can't evaluate in the background.")
+        else:
+            for region in self.view.sel():
+                eval_region = self.get_eval_region(
+                    region, scope=scope, ignore=set(ignore)
+                )
+
+                if eval_region:
+                    op = {
+                        "op": "eval",
+                        "code": self.view.substr(eval_region),
+                        "file": self.view.file_name(),
+                        "ns": namespace.find_declaration(self.view) or "user",
+                    }
+
+                    jobs.background_session(
+                        client,
+                        user,
+                        lambda session, op=op: self.start(client, session, op),
+                    )
+
+
+class TutkainShowBackgroundJobsCommand(WindowCommand):
+    """Show every background evaluation that's still running. Choose one to
+    interrupt it."""
+
+    def run(self):
+        client = get_active_view_client(self.window)
+        running = list(client.jobs) if client else []
+
+        if not running:
+            self.window.status_message("No background evaluations running.")
+        else:
+
+            def interrupt(i):
+                if i != -1:
+                    running[i].interrupt()
+
+            self.window.show_quick_panel(
+                [
+                    [
+                        job.code.strip().splitlines()[0],
+                        f"{job.ns} · {jobs.format_elapsed(job.elapsed())}",
+                    ]
+                    for job in running
+                ],
+                interrupt,
+                flags=sublime.MONOSPACE_FONT,
+            )
+
+
 class TutkainEvaluateViewCommand(TextCommand):
     def handler(self, session, response):
         if "err" in response:
@@ -308,10 +682,23 @@ class TutkainEvaluateViewCommand(TextCommand):
             session.send(op, handler=lambda response: self.handler(session, response))
 
 
+def run_tests(view, test_vars=[]):
+    """Run the tests in view via the plugin session of the REPL view of the
+    window of view, and print the results into that REPL view."""
+    sessions = get_active_view_sessions(view.window()) or {}
+    user = sessions.get("user")
+
+    test.run(
+        view,
+        sessions.get("plugin"),
+        test_vars=test_vars,
+        output=user and user.output,
+    )
+
+
 class TutkainRunTestsInCurrentNamespaceCommand(TextCommand):
     def run(self, edit):
-        session = get_session_by_owner(self.view.window(), "plugin")
-        test.run(self.view, session)
+        run_tests(self.view)
 
 
 class TutkainRunTestUnderCursorCommand(TextCommand):
@@ -321,8 +708,18 @@ class TutkainRunTestUnderCursorCommand(TextCommand):
         test_var = test.current(self.view, point)
 
         if test_var:
-            session = get_session_by_owner(self.view.window(), "plugin")
-            test.run(self.view, session, test_vars=[test_var])
+            run_tests(self.view, test_vars=[test_var])
+
+
+def contract_path(path):
+    return path.replace(os.path.expanduser("~"), "~")
+
+
+def is_socket(path):
+    try:
+        return stat.S_ISSOCK(os.stat(path).st_mode)
+    except OSError:
+        return False
 
 
 class HostInputHandler(TextInputHandler):
@@ -336,7 +733,28 @@ class HostInputHandler(TextInputHandler):
         return len(text) > 0
 
     def initial_text(self):
-        return "localhost"
+        sockets = self.discover_sockets()
+        return contract_path(sockets[0]) if sockets else "localhost"
+
+    def socket_possibilities(self, folder):
+        yield os.path.join(folder, ".nrepl-socket")
+
+        project_socket_file = (
+            self.window.project_data().get("tutkain", {}).get("nrepl_socket_file")
+        )
+
+        if project_socket_file:
+            yield os.path.join(folder, project_socket_file)
+
+    def discover_sockets(self):
+        """Return the paths to the Unix domain sockets of the nREPL servers in
+        the folders of the window."""
+        return [
+            path
+            for folder in self.window.folders()
+            for path in self.socket_possibilities(folder)
+            if is_socket(path)
+        ]
 
     def read_port(self, path):
         with open(path, "r") as file:
@@ -362,6 +780,10 @@ class HostInputHandler(TextInputHandler):
         ]
 
     def next_input(self, host):
+        # Sockets don't need a port.
+        if is_socket(os.path.expanduser(host)):
+            return None
+
         ports = self.discover_ports()
 
         if len(ports) > 1:
@@ -399,12 +821,9 @@ class PortsInputHandler(ListInputHandler):
     def validate(self, text):
         return text.isdigit()
 
-    def contract_path(self, path):
-        return path.replace(os.path.expanduser("~"), "~")
-
     def list_items(self):
         return list(
-            map(lambda x: (f"{x[1]} ({self.contract_path(x[0])})", x[1]), self.ports)
+            map(lambda x: (f"{x[1]} ({contract_path(x[0])})", x[1]), self.ports)
         )
 
 
@@ -469,135 +888,151 @@ class TutkainConnectCommand(WindowCommand):
                 ),
             )
 
-    def create_sessions(self, client, sideloader, view, response):
-        if response.get("status") == ["done"]:
-            info = response
-            sideloader.info = info
-            sideloader.output(response)
-
-            def create_session(owner, response):
-                if response.get("status") == ["done"]:
-                    new_session_id = response["new-session"]
-                    new_session = Session(new_session_id, client, view)
-                    new_session.info = info
-                    client.register_session(owner, new_session)
-
-            sideloader.send(
-                {"op": "clone", "session": sideloader.id},
-                handler=lambda response: create_session("plugin", response),
-            )
-
-            sideloader.send(
-                {"op": "clone", "session": sideloader.id},
-                handler=lambda response: create_session("user", response),
+    def print(self, frame, view, item):
+        if view and "value" in item:
+            folds.feed(
+                frame,
+                view,
+                formatter.format(item),
+                settings().get("result_max_lines"),
+                id=item.get("id"),
             )
+        elif view:
+            folds.end(view)
 
-    def initialize(self, client, sideloader, view):
-        def add_tap(response):
-            if response.get("status") == ["done"]:
-
-                def handler(response):
-                    if response.get("status") == ["done"]:
-                        sideloader.send(
-                            {"op": "describe"},
-                            handler=lambda response: self.create_sessions(
-                                client, sideloader, view, response
-                            ),
-                        )
-
-                sideloader.send({"op": "tutkain/add-tap"}, handler=handler)
-
-        def add_middleware(response):
-            if response.get("status") == ["done"]:
-                sideloader.send(
-                    {
-                        "op": "add-middleware",
-                        "middleware": [
-                            "tutkain.nrepl.middleware.test/wrap-test",
-                            "tutkain.nrepl.middleware.tap/wrap-tap",
-                        ],
-                    },
-                    handler=add_tap,
-                )
-
-        sideloader.send(
-            {"op": "sideloader-start"},
-            handler=lambda response: self.sideloader_provide(sideloader, response),
-        )
-
-        sideloader.send(
-            {"op": "eval", "code": """(require 'tutkain.nrepl.util.pprint)"""},
-            pprint=False,
-            handler=add_middleware,
-        )
-
-    def print(self, view, item):
-        if view:
             if {
-                "value",
                 "nrepl.middleware.caught/throwable",
                 "in",
                 "versions",
                 "summary",
             } & item.keys():
-                append_to_view(view, formatter.format(item))
+                frame.append(view, formatter.format(item), kind=kind_of(item))
             elif "status" in item and "interrupted" in item["status"]:
-                append_to_view(view, ":tutkain/interrupted\n")
+                frame.append(view, ":tutkain/interrupted\n", kind="status")
             elif "status" in item and "session-idle" in item["status"]:
-                append_to_view(view, ":tutkain/nothing-to-interrupt\n")
+                frame.append(view, ":tutkain/nothing-to-interrupt\n", kind="status")
             else:
-                characters = formatter.format(item)
-
-                if characters:
-                    append_to_view(view, characters)
-
-                    size = view.size()
-                    key = str(uuid.uuid4())
-                    regions = [sublime.Region(size - len(characters), size)]
-                    scope = (
-                        "tutkain.repl.stderr"
-                        if "err" in item
-                        else "tutkain.repl.stdout"
-                    )
+                scope = (
+                    "tutkain.repl.stderr" if "err" in item else "tutkain.repl.stdout"
+                )
+                frame.append(
+                    view, formatter.format(item), scope=scope, kind=kind_of(item)
+                )
 
-                    view.add_regions(
-                        key, regions, scope=scope, flags=sublime.DRAW_NO_OUTLINE
-                    )
+    def print_item(self, frame, client, item):
+        log.debug({"event": "printer/recv", "data": item})
+
+        frame.messages += 1
+        session = client.sessions.get(item.get("session"))
+
+        if "tap" in item and settings().get("tap_panel"):
+            for window in get_client_windows(client):
+                tap.show_panel(window, client)
+                frame.append(tap.find_panel(window, client), item["tap"])
+        elif session:
+            view = session.view
+            self.print(frame, view, item)
+
+            if "status" in item and "done" in item["status"]:
+                last_char = frame.last_char(view)
+
+                if last_char is None:
+                    view_size = view.size()
+                    last_char = view.substr(sublime.Region(view_size - 1, view_size))
+
+                if not (last_char == "\n"):
+                    frame.append(view, "\n", kind="status")
+        else:
+            # Messages outside of any session concern every view that uses the
+            # client.
+            for view in get_client_views(client):
+                self.print(frame, view, item)
+
+    def render(self, output):
+        view = output.view
+        characters = output.text()
+        append_to_view(view, characters)
+
+        transcript = state["transcript_by_view"].get(view.id())
+        transcript and transcript.append(output.record_text(), output.runs)
+
+        size = view.size()
+        begin = size - len(characters)
+
+        for scope, offsets in output.regions.items():
+            highlights.add(view, scope, [(begin + b, begin + e) for b, e in offsets])
+
+        started = set()
+
+        for offset, fold in output.folds:
+            # Put the phantom at the end of the last line the view shows.
+            show_fold(view, fold, max(begin + offset - 1, 0))
+            started.add(fold)
+
+        for fold in output.grown - started:
+            fold.phantom is not None and update_fold(view, fold)
+
+        max_size = settings().get("output_view_max_size")
+
+        if max_size and size > max_size:
+            view.run_command(
+                "tutkain_trim_output_view",
+                {"size": int(max_size * OUTPUT_VIEW_TRIM_TO)},
+            )
+
+    def print_items(self, printer, client, items):
+        """Print items into their views, appending into each view only once."""
+        frame = Frame()
+
+        for item in items:
+            if item is not None:
+                self.print_item(frame, client, item)
+
+        printer.render(frame, self.render)
 
     def print_loop(self, client):
+        printer = Printer()
+
         try:
             while True:
-                item = client.recvq.get()
+                items = [client.recvq.get()]
+
+                # Print everything that arrives before the next frame along
+                # with the first item.
+                if items[0] is not None:
+                    items.extend(take(client.recvq, printer.next_frame()))
+
+                self.print_items(printer, client, items)
 
-                if item is None:
+                if items[-1] is None:
                     break
+        finally:
+            log.debug({"event": "thread/exit"})
 
-                log.debug({"event": "printer/recv", "data": item})
+    def print_queued(self, client, printer):
+        """Print every item in the receive queue of a client."""
+        items = client.recvq.take()
+        items and self.print_items(printer, client, items)
 
-                session = client.sessions.get(item.get("session"))
+        if items and items[-1] is None:
+            log.debug({"event": "printer/stop"})
 
-                if "tap" in item and settings().get("tap_panel"):
-                    tap.show_panel(self.window, client)
-                    append_to_view(tap.find_panel(self.window, client), item["tap"])
-                elif session:
-                    self.print(session.view, item)
+    def schedule_printing(self, client):
+        """Print the items in the receive queue of a client once they arrive,
+        at most once per frame.
 
-                    view_size = session.view.size()
-                    last_char = session.view.substr(
-                        sublime.Region(view_size - 1, view_size)
-                    )
+        Clients that use the shared I/O engine use this instead of starting a
+        print_loop thread of their own. An idle client costs nothing."""
+        printer = Printer()
 
-                    if (
-                        "status" in item
-                        and "done" in item["status"]
-                        and not (last_char == "\n")
-                    ):
-                        append_to_view(session.view, "\n")
-                else:
-                    view = get_active_repl_view(self.window)
-                    self.print(view, item)
-        finally:
-            log.debug({"event": "thread/exit"})
+        def schedule():
+            delay = max(0, printer.next_frame() - time.monotonic())
+
+            sublime.set_timeout_async(
+                lambda: self.print_queued(client, printer), int(delay * 1000)
+            )
+
+        client.recvq.notify(schedule)
 
     def set_layout(self):
         # Set up a two-row layout.
@@ -620,7 +1055,7 @@ class TutkainConnectCommand(WindowCommand):
 
         self.window.set_layout(layout)
 
-    def create_output_view(self, host, port):
+    def create_output_view(self, name):
         self.set_layout()
         active_view = self.window.active_view()
 
@@ -628,7 +1063,7 @@ class TutkainConnectCommand(WindowCommand):
         suffix = "" if view_count == 0 else f" ({view_count})"
 
         view = self.window.new_file()
-        view.set_name(f"REPL | {host}:{port}{suffix}")
+        view.set_name(f"REPL | {name}{suffix}")
         view.settings().set("line_numbers", False)
         view.settings().set("gutter", False)
         view.settings().set("is_widget", True)
@@ -659,61 +1094,156 @@ class TutkainConnectCommand(WindowCommand):
             panel.settings().set("scroll_past_end", False)
             panel.assign_syntax("Clojure (Tutkain).sublime-syntax")
 
-    def clone_handler(self, client, view, capabilities, response):
-        if "done" in response.get("status", []):
-            session_id = response.get("new-session")
-            session = Session(session_id, client, view)
-
+    def handshake(self, client, view, on_done=None):
+        Handshake(
+            client,
+            view,
+            self.sideloader_provide,
+            plugin_sessions=settings().get("plugin_sessions", 2),
+            debug=settings().get("debug", False),
+            cache=capabilities_cache(),
+            on_done=on_done,
+        ).start()
+
+    def clone_user_session(self, client, view):
+        """Clone a user session for a REPL view that shares its client with a
+        REPL view in another window."""
+        state["user_session_by_view"][view.id()] = None
+
+        def handler(response):
+            if "new-session" in response:
+                session = Session(response["new-session"], client, view)
+                user = client.sessions_by_owner.get("user")
+                session.info = user.info if user else {}
+
+                if view.id() not in state["client_by_view"]:
+                    # The view closed before the server cloned the session.
+                    client.send(
+                        {"op": "close", "session": session.id},
+                        handler=lambda _: None,
+                    )
+                elif view.id() in state["user_session_by_view"]:
+                    client.add_session("user", session)
+                    state["user_session_by_view"][view.id()] = session
+                else:
+                    # The REPL view whose user session was the user session of
+                    # the client closed in the meantime. See hand_over.
+                    client.register_session("user", session)
+
+        client.clone(handler, session=client.sessions_by_owner.get("sideloader"))
+
+    def reconnect(self, client):
+        """Set up the sessions and the middleware again once reconnected."""
+        view = get_primary_view(client)
+
+        def on_done():
+            for shared_view in get_client_views(client):
+                if shared_view.id() in state["user_session_by_view"]:
+                    self.clone_user_session(client, shared_view)
+
+        view and self.handshake(client, view, on_done=on_done)
+
+    def share(self, client, name):
+        """Show a REPL view for a client another window already uses, and give
+        the view a user session of its own."""
+        self.create_tap_panel(client)
+        view = self.create_output_view(name)
+        state["client_by_view"][view.id()] = client
+        start_transcript(client, view)
+        self.clone_user_session(client, view)
+
+    def start_printing(self, client):
+        if client.engine:
+            self.schedule_printing(client)
+        else:
             # Start a worker thread that reads items from a queue and prints
             # them into an output panel.
             print_loop = Thread(daemon=True, target=self.print_loop, args=(client,))
-
             print_loop.name = "tutkain.print_loop"
             print_loop.start()
 
-            if "sideloader-start" in capabilities["ops"]:
-                client.register_session("sideloader", session)
-                self.initialize(client, session, view)
-            else:
-                # Babashka
-                client.register_session("plugin", session)
-                session.info = capabilities
-                session.output(capabilities)
-
-                def handler(response):
-                    if response.get("status") == ["done"]:
-                        session = Session(response["new-session"], client, view)
-                        session.info = capabilities
-                        client.register_session("user", session)
-
-                client.send({"op": "clone"}, handler=handler)
-
-    def clone(self, client, view, response):
-        if response.get("status") == ["done"]:
-            capabilities = response
-
-            client.send(
-                {"op": "clone"},
-                handler=lambda response: self.clone_handler(
-                    client, view, capabilities, response
-                ),
-            )
+    def engine(self):
+        if settings().get("io_engine") == "selector":
+            return engine.get()
+
+    def start_prepl(self, client, view):
+        """Give a prepl client a session. The session stands in for both the
+        user session and the plugin session."""
+        session = prepl.PreplSession(client, view)
+        client.register_session("user", session)
+        client.register_session("plugin", session)
+
+    def run(self, host, port=None, transport="nrepl"):
+        if port is None:
+            # Without a port, the host is the path to a Unix domain socket.
+            path = os.path.expanduser(host)
+            host = None
+            name = contract_path(path)
+        else:
+            path = None
+            port = int(port)
+            name = f"{host}:{port}"
+
+        if transport == "nrepl":
+            client = find_client(path or (host, port))
 
-    def describe(self, client, view):
-        client.send(
-            {"op": "describe"},
-            handler=lambda response: self.clone(client, view, response),
+            if client:
+                self.share(client, name)
+                return
+
+        client = (prepl.PreplClient if transport == "prepl" else Client)(
+            host,
+            port,
+            SendQueue(),
+            Mailbox(),
+            engine=self.engine(),
+            dedicated=settings().get("dedicated_connections", []),
+            reconnect=settings().get("auto_reconnect", True),
+            connect_timeout=settings().get("connect_timeout", 10),
+            path=path,
         )
 
-    def run(self, host, port):
-        try:
-            client = Client(host, int(port), queue.Queue(), queue.Queue()).go()
+        progress = ProgressBar(f"[Tutkain] Connecting to {name}...")
+        progress.start()
+
+        def on_connected():
+            progress.stop()
             self.create_tap_panel(client)
-            view = self.create_output_view(host, port)
+            view = self.create_output_view(name)
             state["client_by_view"][view.id()] = client
-            self.describe(client, view)
-        except ConnectionRefusedError:
-            self.window.status_message(f"ERR: connection to {host}:{port} refused.")
+            start_transcript(client, view)
+            self.start_printing(client)
+
+            if transport == "prepl":
+                self.start_prepl(client, view)
+                client.on_reconnect = lambda client: self.start_prepl(client, view)
+            else:
+                self.handshake(client, view)
+                client.on_reconnect = self.reconnect
+
+        def on_error(message):
+            progress.stop()
+            self.window.status_message(f"ERR: {message}")
+
+        def connect():
+            try:
+                client.go()
+                sublime.set_timeout(on_connected)
+            except ConnectionRefusedError:
+                message = f"connection to {name} refused."
+                sublime.set_timeout(lambda: on_error(message))
+            except socket.timeout:
+                message = f"connection to {name} timed out."
+                sublime.set_timeout(lambda: on_error(message))
+            except OSError as error:
+                message = f"couldn't connect to {name}: {error}"
+                sublime.set_timeout(lambda: on_error(message))
+
+        # Connect on a thread of its own, so that an unreachable host doesn't
+        # freeze Sublime Text.
+        thread = Thread(daemon=True, target=connect)
+        thread.name = "tutkain.connect"
+        thread.start()
 
     def input(self, args):
         return HostInputHandler(self.window)
@@ -793,6 +1323,7 @@ class TutkainViewEventListener(ViewEventListener):
                         handler=lambda response: self.handle_completions(
                             completion_list, response
                         ),
+                        timeout=PLUGIN_OP_TIMEOUT,
                     )
 
                     return completion_list
@@ -818,7 +1349,7 @@ def lookup(view, point, handler):
                 if ns:
                     op["ns"] = ns
 
-                session.send(op, handler=handler)
+                session.send(op, handler=handler, timeout=PLUGIN_OP_TIMEOUT)
 
 
 class TutkainShowSymbolInformationCommand(TextCommand):
@@ -863,9 +1394,17 @@ class TutkainEventListener(EventListener):
             client = get_view_client(view)
 
             if client:
-                client.halt()
+                user = get_view_sessions(view).get("user")
                 forget_repl_view(view)
 
+                if get_client_views(client):
+                    # REPL views in other windows still use the client, so only
+                    # close the user session of this view.
+                    user and user.send({"op": "close"})
+                    hand_over(client, view)
+                else:
+                    client.halt()
+
                 # TODO: This sometimes crashes ST.
                 #
                 # window.set_layout({
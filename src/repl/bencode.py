@@ -23,6 +23,14 @@ Example:
     print(bencode.write(buf, {'foo': 42, 'bar': 'spam'}))
     # => b'd3:bar4:spam3:fooi42ee'
 
+To read values straight off a socket without going through a BufferedReader,
+feed whatever recv() returns into a Decoder:
+
+    decoder = bencode.Decoder()
+
+    for value in decoder.feed(socket.recv(4096)):
+        print(value)
+
 Has complete faith in the sending end. That is, does not try to recover from
 any errors.
 """
@@ -30,6 +38,10 @@ any errors.
 
 ENCODING = "utf-8"
 
+# The keys whose values can be large and that nothing needs for routing a
+# message to its handler.
+PAYLOAD_KEYS = frozenset({"value", "out", "err", "tap", "actual", "expected"})
+
 
 def read_until(b, terminator):
     """Read bytes until the given terminator byte.
@@ -45,94 +57,335 @@ def read_until(b, terminator):
     return bs
 
 
-def read_list(b):
-    items = []
+def into_dict(xs):
+    """Convert a list into a dict."""
+    return {xs[i]: xs[i + 1] for i in range(0, len(xs), 2)}
+
+
+def read_int(b):
+    return int(read_until(b, b"e"))
+
+
+def read(b):
+    """Read bencodes values from a BufferedReader into Python values.
+
+    Keeps the lists and dicts it hasn't finished reading on a stack instead of
+    recursing, so it can read values of any depth."""
+    # Every item on the stack is a tuple of the items of a list or a dict we
+    # haven't finished reading yet and whether it's a dict.
+    stack = []
 
     while True:
-        item = read(b)
+        first_byte = b.read(1)
+
+        # If the first byte is empty, the most likely reason is that the TCP server has died.
+        #
+        # If we don't take that into account here, our receive loop will keep flooding the system
+        # with recvfrom syscalls until the parent process dies. Eventually, the parent process
+        # ends up taking 100% of CPU time.
+        if not first_byte:
+            return None
+        elif first_byte == b"d":
+            stack.append(([], True))
+            continue
+        elif first_byte == b"l":
+            stack.append(([], False))
+            continue
+        elif first_byte == b"e":
+            if not stack:
+                return None
+
+            items, is_dict = stack.pop()
+            value = into_dict(items) if is_dict else items
+        elif first_byte == b"i":
+            value = read_int(b)
+        else:
+            n = int(first_byte + read_until(b, b":"))
+            value = b.read(n).decode(ENCODING)
 
-        if item is None:
-            return items
+        if stack:
+            stack[-1][0].append(value)
         else:
-            items.append(item)
+            return value
 
 
-def into_dict(xs):
-    """Convert a list into a dict."""
-    return {xs[i]: xs[i + 1] for i in range(0, len(xs), 2)}
+class Message(dict):
+    """A dict that leaves some of its string values as a bytearray until
+    they're needed.
 
+    Decodes such a value into a string the first time you get it via
+    message[key], get(), pop(), values(), or items(). Operations that copy
+    the dict on the C level, such as dict(message) or {**message}, copy the
+    bytearray as is."""
 
-def read_dict(b):
-    return into_dict(read_list(b))
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
 
+        if value.__class__ is bytearray:
+            value = value.decode(ENCODING)
+            dict.__setitem__(self, key, value)
 
-def read_int(b):
-    return int(read_until(b, b"e"))
+        return value
 
+    def get(self, key, default=None):
+        return self[key] if key in self else default
 
-def read(b):
-    """Read bencodes values from a BufferedReader into Python values."""
-    first_byte = b.read(1)
+    def pop(self, key, *default):
+        value = dict.pop(self, key, *default)
+        return value.decode(ENCODING) if value.__class__ is bytearray else value
+
+    def values(self):
+        return [self[key] for key in self]
 
-    # If the first byte is empty, the most likely reason is that the TCP server has died.
-    #
-    # If we don't take that into account here, our receive loop will keep flooding the system with
-    # recvfrom syscalls until the parent process dies. Eventually, the parent process ends up taking
-    # 100% of CPU time.
-    if not first_byte or first_byte == b"e":
-        return None
-    elif first_byte == b"d":
-        return read_dict(b)
-    elif first_byte == b"l":
-        return read_list(b)
-    elif first_byte == b"i":
-        return read_int(b)
-    else:
-        n = int(first_byte + read_until(b, b":"))
-        return b.read(n).decode(ENCODING)
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    def copy(self):
+        return Message(self)
+
+    def __eq__(self, other):
+        return dict(self.items()) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+
+class Decoder(object):
+    """An incremental bencode decoder.
+
+    Feed it chunks of bytes in whatever sizes they happen to arrive in. The
+    decoder keeps partially read values between calls to feed() and yields
+    every value it has read in full.
+
+    If you give the decoder a set of lazy keys, it reads every dict into a
+    Message and leaves string values of those keys undecoded until someone
+    asks for them."""
+
+    def __init__(self, lazy_keys=frozenset()):
+        self.buffer = bytearray()
+        self.position = 0
+        self.lazy_keys = lazy_keys
+        # Every item on the stack is a tuple of the items of a list or a dict
+        # we haven't finished reading yet and whether it's a dict.
+        self.stack = []
+
+    def feed(self, data):
+        """Add bytes into the decoder.
+
+        Return a generator that yields every value the decoder can read in
+        full."""
+        self.buffer.extend(data)
+        return self.values()
+
+    def values(self):
+        buf = self.buffer
+        stack = self.stack
+        position = self.position
+        lazy_keys = self.lazy_keys
+        make_dict = Message if lazy_keys else dict
+
+        while position < len(buf):
+            byte = buf[position]
+
+            if byte == 0x64:  # d
+                stack.append(([], True))
+                position += 1
+                continue
+            elif byte == 0x6C:  # l
+                stack.append(([], False))
+                position += 1
+                continue
+            elif byte == 0x65:  # e
+                if not stack:
+                    raise ValueError(f"Unexpected end of value at {position}")
+
+                items, is_dict = stack.pop()
+                value = make_dict(zip(items[::2], items[1::2])) if is_dict else items
+                position += 1
+            elif byte == 0x69:  # i
+                start = position + 1
+                end = buf.find(b"e", start)
+
+                if end == -1:
+                    break
+
+                value = int(buf[start:end])
+                position = end + 1
+            else:
+                colon = buf.find(b":", position)
+
+                if colon == -1:
+                    break
+
+                start = colon + 1
+                end = start + int(buf[position:colon])
+
+                if end > len(buf):
+                    break
+
+                value = buf[start:end]
+                position = end
+
+                if not (
+                    lazy_keys
+                    and stack
+                    and stack[-1][1]
+                    and len(stack[-1][0]) % 2
+                    and stack[-1][0][-1] in lazy_keys
+                ):
+                    value = value.decode(ENCODING)
+
+            if stack:
+                stack[-1][0].append(value)
+            else:
+                self.position = position
+                yield value
+
+        # Drop the bytes we've already read. Deleting from the start of a
+        # bytearray doesn't copy the rest of it.
+        del buf[:position]
+        self.position = 0
+
+
+# The most items to keep in each of the caches below. Messages only ever have a
+# handful of different keys and key orders, so this is a safeguard more than
+# anything.
+MAX_CACHE_SIZE = 1024
+
+# Bencoded forms of strings we've seen as dict keys.
+encoded_keys = {}
+
+# Sorted lists of dict keys, keyed by the keys in insertion order.
+sorted_keys = {}
+
+
+def encode_str(s):
+    encoded = s.encode(ENCODING)
+    return b"%d:%s" % (len(encoded), encoded)
+
+
+class EncodedKey(object):
+    """The bencoded form of a dict key.
+
+    Sets the keys the encoder writes apart from bytes values, which bencode
+    can't hold."""
+
+    __slots__ = ("encoded",)
+
+    def __init__(self, encoded):
+        self.encoded = encoded
+
+
+def encode_key(k):
+    """Return the bencoded form of a dict key, caching it."""
+    encoded = encoded_keys.get(k)
+
+    if encoded is None:
+        encoded = EncodedKey(encode_str(k))
+
+        if len(encoded_keys) < MAX_CACHE_SIZE:
+            encoded_keys[k] = encoded
+
+    return encoded
+
+
+def sort_keys(d):
+    """Return the keys of a dict in sorted order, caching the result."""
+    keys = tuple(d)
+    ks = sorted_keys.get(keys)
+
+    if ks is None:
+        ks = sorted(keys)
+
+        if len(sorted_keys) < MAX_CACHE_SIZE:
+            sorted_keys[keys] = ks
+
+    return ks
+
+
+class Fragment(object):
+    """A value encoded into bencode ahead of time.
+
+    Use a fragment for a value you send over and over again. The encoder
+    copies the bytes of a fragment into the message as is."""
+
+    __slots__ = ("value", "encoded")
+
+    def __init__(self, value):
+        self.value = value
+        self.encoded = bytes(Encoder().encode(value))
+
+    def __repr__(self):
+        return f"Fragment({self.value!r})"
+
+
+class Encoder(object):
+    """Encodes values into a single bytearray that it reuses for every
+    message.
 
+    Example:
 
-def write_int(buf, i):
-    buf.write(f"i{i}e".encode(ENCODING))
+        encoder = bencode.Encoder()
+        socket.sendall(encoder.encode({"op": "describe"}))
+        encoder.clear()
+    """
 
+    def __init__(self):
+        self.buffer = bytearray()
 
-def write_str(buf, s):
-    length = len(s.encode(ENCODING))
-    buf.write(f"{length}:{s}".encode(ENCODING))
+    def clear(self):
+        del self.buffer[:]
 
+    def encode(self, x):
+        """Append the bencoded form of a Python value into the buffer.
 
-def write_list(buf, xs):
-    buf.write(b"l")
+        Return the buffer."""
+        buf = self.buffer
 
-    for x in xs:
-        write_value(buf, x)
+        # Like read(), keeps the lists and dicts it hasn't finished writing on
+        # a stack instead of recursing. Every item on the stack is an iterator
+        # over the values left to write.
+        stack = [iter((x,))]
 
-    buf.write(b"e")
+        while stack:
+            for x in stack[-1]:
+                if isinstance(x, str):
+                    encoded = x.encode(ENCODING)
+                    buf += b"%d:" % len(encoded)
+                    buf += encoded
+                elif isinstance(x, (EncodedKey, Fragment)):
+                    buf += x.encoded
+                elif isinstance(x, int):
+                    buf += b"i%de" % x
+                elif isinstance(x, list):
+                    buf += b"l"
+                    stack.append(iter(x))
+                    break
+                elif isinstance(x, dict):
+                    buf += b"d"
+                    items = []
 
+                    for k in sort_keys(x):
+                        items.append(encode_key(k))
+                        items.append(x[k])
 
-def write_dict(buf, d):
-    buf.write(b"d")
-    ks = list(d.keys())
-    ks.sort()
+                    stack.append(iter(items))
+                    break
+                else:
+                    raise ValueError(f"""Can't write {x} into bencode""")
+            else:
+                stack.pop()
 
-    for k in ks:
-        write_value(buf, k)
-        write_value(buf, d[k])
+                # The bottom of the stack is the value itself, not a list or a
+                # dict.
+                if stack:
+                    buf += b"e"
 
-    buf.write(b"e")
+        return buf
 
 
 def write_value(buf, x):
-    if isinstance(x, int):
-        write_int(buf, x)
-    elif isinstance(x, str):
-        write_str(buf, x)
-    elif isinstance(x, list):
-        write_list(buf, x)
-    elif isinstance(x, dict):
-        write_dict(buf, x)
-    else:
-        raise ValueError(f"""Can't write {x} into bencode""")
+    buf.write(Encoder().encode(x))
 
 
 def write(buf, x):
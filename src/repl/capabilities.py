@@ -0,0 +1,75 @@
+import json
+import os
+from threading import Lock
+
+from ..log import log
+
+
+# The most servers to remember the capabilities of.
+MAX_ENTRIES = 64
+
+
+def key(address, versions, middleware=()):
+    """Return the cache key for the capabilities of the server at the given
+    address (see Client.address) with the given versions and middleware."""
+    return json.dumps(
+        [address, versions, sorted(middleware)], sort_keys=True, default=str
+    )
+
+
+def trim(response):
+    """Return the parts of a describe response worth caching."""
+    return {
+        "ops": {op: {} for op in response.get("ops", {})},
+        "versions": response.get("versions", {}),
+    }
+
+
+class Cache(object):
+    """Remembers the response to the describe op of every server we've
+    connected to, in a JSON file.
+
+    If we know the capabilities of a server, we don't need to ask for them
+    again the next time we connect to it."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = Lock()
+        self.entries = None
+
+    def load(self):
+        if self.entries is None:
+            try:
+                with open(self.path, "r", encoding="utf-8") as file:
+                    self.entries = json.load(file)
+            except (OSError, ValueError) as error:
+                log.debug({"event": "capabilities/load", "error": error})
+                self.entries = {}
+
+        return self.entries
+
+    def get(self, key):
+        with self.lock:
+            return self.load().get(key)
+
+    def put(self, key, response):
+        with self.lock:
+            entries = self.load()
+            entries.pop(key, None)
+            entries[key] = trim(response)
+
+            # Dicts remember insertion order, so the first key is the one we
+            # put in longest ago.
+            while len(entries) > MAX_ENTRIES:
+                del entries[next(iter(entries))]
+
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                temp = self.path + ".tmp"
+
+                with open(temp, "w", encoding="utf-8") as file:
+                    json.dump(entries, file)
+
+                os.replace(temp, self.path)
+            except OSError as error:
+                log.error({"event": "capabilities/save", "error": error})
@@ -1,61 +1,165 @@
-import queue
-import socket
 import uuid
-from threading import Thread, Event
-
-from . import bencode
+from concurrent.futures import CancelledError, InvalidStateError
+from threading import Event, Thread
+
+from . import timer
+from .connection import Connection, SendQueue
+from .handlers import Registry
+from .jobs import Jobs
+from .session import SessionPool
 from ..log import log
 
 
+# How long, in seconds, to wait before the first attempt to reconnect. Every
+# failed attempt doubles the wait, up to RECONNECT_MAX_DELAY.
+RECONNECT_DELAY = 0.5
+RECONNECT_MAX_DELAY = 30
+RECONNECT_ATTEMPTS = 10
+
+# Ops we can safely send again if the connection drops before the server
+# responds to them.
+REPLAYABLE_OPS = frozenset({"completions", "eldoc", "info", "lookup"})
+
+
+def transfer(future, to):
+    """Resolve the future to with the result of future, and cancel future if
+    someone cancels to."""
+
+    def done(future):
+        try:
+            to.set_result(future.result())
+        except CancelledError:
+            to.cancel()
+        except InvalidStateError:
+            # Someone cancelled to.
+            pass
+        except Exception as error:
+            to.done() or to.set_exception(error)
+
+    def cancel(to):
+        to.cancelled() and future.cancel()
+
+    future.add_done_callback(done)
+    to.add_done_callback(cancel)
+
+
 class Client(object):
+    """A client for an nREPL server.
+
+    Sends every op over a single connection, except for the ops of the
+    sessions whose owner is in dedicated. Each of those owners gets a
+    connection of its own, so that, say, a long evaluation in the user session
+    doesn't hold back the responses the plugin session is waiting for.
+
+    If reconnect is True and the connection drops, tries to reconnect, waiting
+    longer after every failed attempt. Once reconnected, calls on_reconnect
+    with the client. on_reconnect must set up the sessions again; when it
+    registers a session under the same owner as before, the client sends the
+    replayable ops the old session was waiting for responses to via the new
+    session.
+
+    If given a path, connects to the Unix domain socket at that path instead of
+    host and port.
+
+    If connect_timeout is not None, gives up connecting, or reconnecting, if
+    the server doesn't accept the connection in that many seconds."""
+
+    def address(self):
+        """Return the path to the Unix domain socket of the server, if any, or
+        else its host and port."""
+        return self.path or (self.host, self.port)
+
     def connect(self):
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.socket.connect((self.host, self.port))
-        self.buffer = self.socket.makefile(mode="rwb")
+        address = self.address()
+        timeout = self.connect_timeout
+        self.connection = Connection(self, address, self.sendq).connect(timeout)
 
-        log.debug({"event": "socket/connect", "host": self.host, "port": self.port})
+        for owner in self.dedicated:
+            connection = Connection(self, address, SendQueue())
+            self.connections[owner] = connection.connect(timeout)
 
         return self
 
     def disconnect(self):
-        if self.socket is not None:
-            try:
-                self.buffer.close()
-                self.socket.shutdown(socket.SHUT_RDWR)
-                self.socket.close()
-                log.debug({"event": "socket/disconnect"})
-            except OSError as e:
-                log.debug({"event": "error", "exception": e})
-
-    def __init__(self, host, port, sendq, recvq):
+        self.connection and self.connection.disconnect()
+
+        for connection in list(self.connections.values()):
+            connection.disconnect()
+
+    def __init__(
+        self,
+        host,
+        port,
+        sendq,
+        recvq,
+        engine=None,
+        dedicated=(),
+        reconnect=False,
+        connect_timeout=None,
+        path=None,
+    ):
         self.uuid = str(uuid.uuid4())
         self.host = host
         self.port = port
+        self.path = path
         self.sendq = sendq
         self.recvq = recvq
+        self.engine = engine
+        self.dedicated = dedicated
+        self.connect_timeout = connect_timeout
+        self.connection = None
+        self.connections = {}
         self.stop_event = Event()
         self.sessions = {}
         self.sessions_by_owner = {}
-        self.handlers = {}
+        self.handlers = Registry()
+        self.jobs = Jobs()
+        self.reconnect = reconnect
+        self.on_reconnect = None
+        # The sessions we had before the connection dropped, by owner.
+        self.lost_sessions = {}
 
     def id(self):
         return self.uuid
 
-    def register_session(self, owner, session):
+    def add_session(self, owner, session):
+        """Route the responses to the ops of a session to it, but don't let it
+        stand in for its owner. See register_session."""
+        session.owner = owner
         self.sessions[session.id] = session
-        self.sessions_by_owner[owner] = session
         return session
 
-    def go(self):
-        self.connect()
+    def register_session(self, owner, session):
+        self.add_session(owner, session)
+        pool = self.sessions_by_owner.get(owner)
 
-        send_loop = Thread(daemon=True, target=self.send_loop)
-        send_loop.name = "tutkain.client.send_loop"
-        send_loop.start()
+        if isinstance(pool, SessionPool):
+            pool.add(session)
+        else:
+            self.sessions_by_owner[owner] = session
 
-        recv_loop = Thread(daemon=True, target=self.recv_loop)
-        recv_loop.name = "tutkain.client.recv_loop"
-        recv_loop.start()
+        lost = self.lost_sessions.pop(owner, None)
+        lost and self.replay(lost, session)
+        return session
+
+    def register_pool(self, owner):
+        """Add every session registered under owner from now on into a pool
+        that stands in for a single session. See SessionPool."""
+        pool = SessionPool()
+        self.sessions_by_owner[owner] = pool
+        return pool
+
+    def go(self):
+        try:
+            self.connect()
+        except OSError:
+            # Close the connections we managed to open.
+            self.disconnect()
+            raise
+        self.connection.go(self.engine)
+
+        for connection in self.connections.values():
+            connection.go(self.engine)
 
         return self
 
@@ -63,28 +167,50 @@ class Client(object):
         self.go()
         return self
 
-    def send_loop(self):
-        while True:
-            item = self.sendq.get()
+    def put(self, op, owner=None):
+        """Put an op into the send queue of the connection of the given owner.
 
-            if item is None:
-                break
+        If the owner has no connection of its own, use the main connection."""
+        self.connections.get(owner, self.connection).put(op)
 
-            log.debug({"event": "socket/send", "item": item})
+    def clone(self, handler, session=None):
+        """Clone session, or start a new session if session is None, and call
+        handler with every response.
 
-            bencode.write(self.buffer, item)
+        The server responds to the clone op in the session it clones, so send
+        the op via that session, or the response never reaches handler."""
+        op = {"op": "clone"}
+        return session.send(op, handler=handler) if session else self.send(op, handler)
 
-        log.debug({"event": "thread/exit"})
+    def send(self, op, handler=None, timeout=None, future=False):
+        """Send an op to the server outside of any session.
 
-    def send(self, op, handler=None):
+        See Session.send."""
         id = str(uuid.uuid4())
         op["id"] = id
 
-        if handler is None:
+        if handler is None and not future:
             handler = self.recvq.put
 
-        self.handlers[id] = handler
-        self.sendq.put(op)
+        result = self.handlers.add(id, handler, timeout=timeout, future=future)
+        self.put(op)
+        return result
+
+    def stats(self):
+        """Return counters for the connection, the handlers of the ops sent
+        outside of any session, and every session."""
+        return {
+            "connection": self.connection and dict(self.connection.stats),
+            "connections": {
+                owner: dict(connection.stats)
+                for owner, connection in self.connections.items()
+            },
+            "handlers": self.handlers.stats(),
+            "sessions": {
+                owner: session.stats()
+                for owner, session in self.sessions_by_owner.items()
+            },
+        }
 
     def handle(self, response):
         id = response.get("id")
@@ -94,41 +220,116 @@ class Client(object):
         if session:
             session.handle(response)
         else:
-            self.handlers.get(id, self.recvq.put)(response)
+            self.handlers.handle(id, response, self.recvq.put)
+
+    def send_disconnect_notification(self, connection):
+        # Every connection notices when the server dies, but we only need to
+        # tell the user once.
+        if connection is not self.connection:
+            return
+
+        # Leave the session out, so that every view that uses the client
+        # prints the notification.
+        if self.sessions_by_owner.get("plugin"):
+            self.recvq.put({"value": ":tutkain/disconnected\n"})
+
+    def replay(self, lost, session):
+        """Send the replayable ops a lost session (or pool of sessions) was
+        waiting for responses to via session.
+
+        The future of a replayed op resolves with the responses to the op we
+        send again."""
+        for lost_session in lost if isinstance(lost, SessionPool) else [lost]:
+            for id, entry in lost_session.handlers.clear():
+                op = entry.op
+
+                if (
+                    op
+                    and op["op"] in REPLAYABLE_OPS
+                    and (entry.handler or entry.future)
+                ):
+                    log.debug({"event": "client/replay", "op": op})
+                    op = {k: v for k, v in op.items() if k not in {"id", "session"}}
+
+                    future = session.send(
+                        op,
+                        handler=entry.handler,
+                        timeout=entry.timeout,
+                        future=entry.future is not None,
+                    )
+
+                    entry.future and transfer(future, entry.future)
+                else:
+                    entry.on_abandon = None
+                    lost_session.handlers.fail(id, entry, "lost its connection")
+
+    def try_reconnect(self, attempt=0):
+        if self.stop_event.is_set():
+            # Someone halted the client while we were waiting to reconnect.
+            self.recvq.put(None)
+            return
 
-    def send_disconnect_notification(self):
-        session = self.sessions_by_owner.get("plugin")
-        session and session.output({"value": ":tutkain/disconnected\n"})
+        log.debug({"event": "client/reconnect", "attempt": attempt})
 
-    def recv_loop(self):
         try:
-            while not self.stop_event.is_set():
-                item = bencode.read(self.buffer)
-
-                if item is None:
-                    self.send_disconnect_notification()
-                    break
-
-                log.debug({"event": "socket/recv", "item": item})
-                self.handle(item)
+            # The old send queue has a poison pill in it.
+            self.sendq = SendQueue()
+            self.connections = {}
+            self.go()
         except OSError as error:
-            log.error({"event": "error", "error": error})
-        finally:
-            # If we receive a stop event, put a None into the queue to tell
-            # consumers to stop reading it.
-            self.recvq.put(None)
-
-            # Feed poison pill to input queue.
-            self.sendq.put(None)
-
-            log.debug({"event": "thread/exit"})
-
-            # We've exited the loop that reads from the socket, so we can
-            # close the connection to the socket.
-            self.disconnect()
+            log.debug({"event": "error", "error": error})
+
+            if attempt + 1 < RECONNECT_ATTEMPTS:
+                self.schedule_reconnect(attempt + 1)
+            else:
+                self.recvq.put({"value": ":tutkain/reconnect-failed\n"})
+                self.recvq.put(None)
+
+            return
+
+        self.recvq.put({"value": ":tutkain/reconnected\n"})
+        self.on_reconnect and self.on_reconnect(self)
+
+    def schedule_reconnect(self, attempt=0):
+        """Try to reconnect after a delay that doubles with every attempt.
+
+        Connecting blocks for up to connect_timeout seconds, so connect on a
+        thread of its own instead of the timer thread every client shares."""
+        delay = min(RECONNECT_MAX_DELAY, RECONNECT_DELAY * 2 ** attempt)
+
+        def start():
+            thread = Thread(daemon=True, target=self.try_reconnect, args=(attempt,))
+            thread.name = "tutkain.client.reconnect"
+            thread.start()
+
+        timer.schedule(delay, start)
+
+    def on_close(self, connection):
+        if connection is self.connection:
+            for connection in list(self.connections.values()):
+                connection.close()
+
+            if self.reconnect and not self.stop_event.is_set():
+                # Forget the sessions of the old connection, but remember
+                # which owner had which, for replaying ops.
+                self.lost_sessions = self.sessions_by_owner
+                self.sessions = {}
+                self.sessions_by_owner = {}
+                self.jobs = Jobs()
+                self.schedule_reconnect()
+            else:
+                # Put a None into the receive queue to tell consumers to stop
+                # reading it.
+                self.recvq.put(None)
+        else:
+            # Send the ops of the owner of the connection over the main
+            # connection from now on.
+            self.connections = {
+                owner: c for owner, c in self.connections.items() if c is not connection
+            }
 
     def halt(self):
-        log.debug({"event": "client/halt"})
+        log.debug({"event": "client/halt", "stats": self.stats()})
 
         def handler(response):
             if "status" in response and "done" in response["status"]:
@@ -137,13 +338,16 @@ class Client(object):
         sessions = self.sessions_by_owner
 
         if sessions:
-            "user" in sessions and sessions["user"].send({"op": "close"})
-            "plugin" in sessions and sessions["plugin"].send({"op": "close"})
+            sideloader = sessions.get("sideloader")
 
-            "sideloader" in sessions and sessions["sideloader"].send(
-                {"op": "close"}, handler=handler
-            )
-        else:
+            # Close the sideloader session last, and stop once the server is
+            # done closing it.
+            for session in list(self.sessions.values()):
+                session is not sideloader and session.send({"op": "close"})
+
+            sideloader and sideloader.send({"op": "close"}, handler=handler)
+
+        if not sessions or self.connection.closed:
             self.stop_event.set()
 
     def __exit__(self, type, value, traceback):
@@ -0,0 +1,295 @@
+import heapq
+import itertools
+import queue
+import socket
+from threading import Thread
+
+from . import bencode
+from ..log import log
+
+
+# The maximum number of bytes to read from the socket at once.
+RECV_BUFFER_SIZE = 65536
+
+# Stop adding ops into a batch once it's this many bytes long, so that one
+# batch of big ops can't hold back more urgent ops for long.
+MAX_BATCH_SIZE = 65536
+
+# The priority of every op, by name. Ops with a lower priority go first. Ops
+# not listed here go in the order they arrive, after the ops listed here.
+PRIORITIES = {
+    "interrupt": 0,
+    "completions": 1,
+    "eldoc": 1,
+    "info": 1,
+    "lookup": 1,
+    # The server waits for these before it can carry on evaluating.
+    "sideloader-provide": 1,
+}
+
+DEFAULT_PRIORITY = 2
+
+# The poison pill goes last, after every op that was queued before it.
+STOP_PRIORITY = 3
+
+
+def priority(op):
+    if op is None:
+        return STOP_PRIORITY
+
+    return PRIORITIES.get(op.get("op"), DEFAULT_PRIORITY)
+
+
+class SendQueue(queue.Queue):
+    """A send queue that hands out the most urgent op first.
+
+    Interactive ops like interrupt, completions and lookup jump ahead of evals
+    and load-file ops. Ops with the same priority come out in the order they
+    went in, so evals and load-file ops never overtake one another."""
+
+    def _init(self, maxsize):
+        self.queue = []
+        self.counter = itertools.count()
+
+    def _qsize(self):
+        return len(self.queue)
+
+    def _put(self, item):
+        heapq.heappush(self.queue, (priority(item), next(self.counter), item))
+
+    def _get(self):
+        return heapq.heappop(self.queue)[2]
+
+
+class Connection(object):
+    """A socket connection to an nREPL server.
+
+    The address is either a (host, port) tuple or the path to a Unix domain
+    socket.
+
+    Sends the ops in its send queue and hands every message it receives to its
+    client. Either runs a send thread and a receive thread of its own or lets
+    an engine (see engine.py) do its I/O."""
+
+    def __init__(self, client, address, sendq):
+        self.client = client
+        self.address = address
+        self.sendq = sendq
+        self.socket = None
+        self.engine = None
+        self.closed = False
+        self.encoder = bencode.Encoder()
+
+        # Only decode the parts of each message we need for routing it. The
+        # payload gets decoded when (and if) a handler or the printer reads it.
+        self.decoder = bencode.Decoder(lazy_keys=bencode.PAYLOAD_KEYS)
+
+        # Bytes the engine has yet to write into the socket.
+        self.outbuf = bytearray()
+
+        # True once the engine has taken the poison pill from the send queue.
+        self.stopping = False
+
+        self.stats = {"ops": 0, "flushes": 0}
+
+    def connect(self, timeout=None):
+        """Connect to the server.
+
+        If the server doesn't accept the connection in timeout seconds, raise
+        socket.timeout."""
+        # A string address is the path to a Unix domain socket.
+        family = socket.AF_UNIX if isinstance(self.address, str) else socket.AF_INET
+        self.socket = socket.socket(family, socket.SOCK_STREAM)
+        self.socket.settimeout(timeout)
+
+        try:
+            self.socket.connect(self.address)
+        except OSError:
+            self.socket.close()
+            raise
+
+        self.socket.settimeout(None)
+
+        if family == socket.AF_INET:
+            # We batch ops ourselves, so don't let Nagle's algorithm hold them
+            # back waiting for ACKs.
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        log.debug({"event": "socket/connect", "address": self.address})
+
+        return self
+
+    def disconnect(self):
+        if self.socket is not None:
+            try:
+                self.socket.shutdown(socket.SHUT_RDWR)
+                self.socket.close()
+                log.debug({"event": "socket/disconnect"})
+            except OSError as e:
+                log.debug({"event": "error", "exception": e})
+
+    def go(self, engine=None):
+        """Start sending and receiving messages.
+
+        If given an engine, let the engine do it. Otherwise, start a thread for
+        sending and another for receiving."""
+        if engine:
+            self.engine = engine
+            self.socket.setblocking(False)
+            engine.register(self)
+        else:
+            send_loop = Thread(daemon=True, target=self.send_loop)
+            send_loop.name = "tutkain.client.send_loop"
+            send_loop.start()
+
+            recv_loop = Thread(daemon=True, target=self.recv_loop)
+            recv_loop.name = "tutkain.client.recv_loop"
+            recv_loop.start()
+
+        return self
+
+    def put(self, op):
+        self.sendq.put(op)
+        self.engine and self.engine.notify(self)
+
+    def batch(self, op):
+        """Encode op and then the ops in the send queue into the encoder buffer,
+        until the queue is empty, the buffer is MAX_BATCH_SIZE bytes long, or
+        we run into the poison pill.
+
+        Return False if we ran into the poison pill, True otherwise."""
+        self.encoder.clear()
+        n = 0
+
+        try:
+            while op is not None:
+                log.debug({"event": "socket/send", "item": op})
+                self.encoder.encode(op)
+                n += 1
+
+                if len(self.encoder.buffer) >= MAX_BATCH_SIZE:
+                    break
+
+                op = self.sendq.get_nowait()
+        except queue.Empty:
+            pass
+
+        if n:
+            self.stats["ops"] += n
+            self.stats["flushes"] += 1
+
+            log.debug(
+                {
+                    "event": "socket/flush",
+                    "ops": n,
+                    "bytes": len(self.encoder.buffer),
+                    "ops-per-flush": self.stats["ops"] / self.stats["flushes"],
+                }
+            )
+
+        # The poison pill comes out of the queue last, so we've encoded every
+        # other op by now.
+        return op is not None
+
+    def send_loop(self):
+        running = True
+
+        while running:
+            running = self.batch(self.sendq.get())
+
+            if self.encoder.buffer:
+                try:
+                    self.socket.sendall(self.encoder.buffer)
+                except OSError as error:
+                    log.error({"event": "error", "error": error})
+                    break
+
+        log.debug({"event": "thread/exit"})
+
+    def receive(self, data):
+        for item in self.decoder.feed(data):
+            log.debug({"event": "socket/recv", "item": item})
+            self.client.handle(item)
+
+    def recv_loop(self):
+        try:
+            while not self.client.stop_event.is_set():
+                data = self.socket.recv(RECV_BUFFER_SIZE)
+
+                # If recv() returns no data, the most likely reason is that
+                # the server has died.
+                if not data:
+                    self.client.send_disconnect_notification(self)
+                    break
+
+                self.receive(data)
+        except OSError as error:
+            log.error({"event": "error", "error": error})
+        finally:
+            log.debug({"event": "thread/exit"})
+            self.close()
+
+    def on_readable(self):
+        """Read from the socket when the engine says there's data to read."""
+        try:
+            data = self.socket.recv(RECV_BUFFER_SIZE)
+        except BlockingIOError:
+            return
+        except OSError as error:
+            log.error({"event": "error", "error": error})
+            self.close()
+            return
+
+        if not data:
+            self.client.send_disconnect_notification(self)
+            self.close()
+        else:
+            self.receive(data)
+
+            if self.client.stop_event.is_set():
+                self.close()
+
+    def write(self):
+        """Encode the ops in the send queue and write as much as the socket
+        will take of the bytes we have yet to write.
+
+        The engine calls this when there are new ops in the queue or when the
+        socket is ready for writing. Only takes more ops from the queue while
+        there are fewer than MAX_BATCH_SIZE bytes left to write, so that urgent
+        ops that arrive in the meantime still get to go first."""
+        while not self.stopping and len(self.outbuf) < MAX_BATCH_SIZE:
+            try:
+                op = self.sendq.get_nowait()
+            except queue.Empty:
+                break
+
+            self.stopping = not self.batch(op)
+            self.outbuf += self.encoder.buffer
+
+        if self.outbuf:
+            try:
+                n = self.socket.send(self.outbuf)
+                del self.outbuf[:n]
+            except BlockingIOError:
+                pass
+            except OSError as error:
+                log.error({"event": "error", "error": error})
+                self.close()
+                return
+
+        if self.stopping and not self.outbuf:
+            self.close()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+
+            # Feed poison pill to input queue.
+            self.sendq.put(None)
+
+            self.engine and self.engine.unregister(self)
+
+            # We've stopped reading from the socket, so we can close the
+            # connection to the socket.
+            self.disconnect()
+            self.client.on_close(self)
@@ -0,0 +1,161 @@
+import selectors
+import socket
+from threading import Lock, Thread
+
+from ..log import log
+
+
+class Engine(object):
+    """Does the I/O of every connection on a single thread.
+
+    Instead of running a send thread and a receive thread for every
+    connection, connections can register with the engine. The engine waits
+    until any of their sockets has data to read or room for writing and then
+    tells the connection to read or write.
+
+    Only the engine thread touches the selector. Other threads tell the engine
+    about new connections and new ops to send via register() and notify(),
+    which wake up the engine thread."""
+
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.lock = Lock()
+        self.registered = []
+        self.notified = set()
+        self.running = False
+
+        # Writing a byte into this socket pair wakes up the engine thread.
+        self.waker, self.wakee = socket.socketpair()
+        self.waker.setblocking(False)
+        self.wakee.setblocking(False)
+        self.selector.register(self.wakee, selectors.EVENT_READ)
+
+    def start(self):
+        self.running = True
+        thread = Thread(daemon=True, target=self.loop)
+        thread.name = "tutkain.engine"
+        thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        self.wake()
+
+    def wake(self):
+        try:
+            self.waker.send(b"\0")
+        except BlockingIOError:
+            # The socket buffer is full, so the engine has plenty of wake-up
+            # calls to read already.
+            pass
+
+    def register(self, connection):
+        with self.lock:
+            self.registered.append(connection)
+
+        self.wake()
+
+    def notify(self, connection):
+        """Tell the engine there are new ops in the send queue of a
+        connection."""
+        with self.lock:
+            self.notified.add(connection)
+
+        self.wake()
+
+    def unregister(self, connection):
+        # Only ever called on the engine thread, when a connection closes.
+        try:
+            self.selector.unregister(connection.socket)
+        except (KeyError, ValueError):
+            pass
+
+    def update(self, connection):
+        """Wait for the socket of a connection to become writable if the
+        connection has bytes it hasn't been able to write yet or ops it hasn't
+        taken from its send queue yet."""
+        if not connection.closed:
+            events = selectors.EVENT_READ
+
+            if connection.outbuf or not connection.sendq.empty():
+                events |= selectors.EVENT_WRITE
+
+            try:
+                self.selector.modify(connection.socket, events, connection)
+            except KeyError:
+                # We haven't registered the connection yet.
+                pass
+
+    def dispatch(self, connection, events):
+        try:
+            if events & selectors.EVENT_READ:
+                connection.on_readable()
+
+            if events & selectors.EVENT_WRITE and not connection.closed:
+                connection.write()
+                self.update(connection)
+        except Exception as error:
+            # Like when a connection runs its own receive thread, an error in
+            # a handler closes the connection. It doesn't stop the engine,
+            # though.
+            log.error({"event": "error", "error": error})
+            connection.close()
+
+    def loop(self):
+        while self.running:
+            for key, events in self.selector.select():
+                connection = key.data
+
+                if connection is None:
+                    try:
+                        while self.wakee.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                else:
+                    self.dispatch(connection, events)
+
+            with self.lock:
+                registered, self.registered = self.registered, []
+                notified, self.notified = self.notified, set()
+
+            for connection in registered:
+                if not connection.closed:
+                    self.selector.register(
+                        connection.socket, selectors.EVENT_READ, connection
+                    )
+
+                    notified.add(connection)
+
+            for connection in notified:
+                if not connection.closed:
+                    connection.write()
+                    self.update(connection)
+
+        log.debug({"event": "thread/exit"})
+
+        self.selector.close()
+        self.waker.close()
+        self.wakee.close()
+
+
+# The engine every connection shares when the io_engine setting is "selector".
+instance = None
+
+
+def get():
+    """Return the shared engine, starting it if necessary."""
+    global instance
+
+    if instance is None:
+        instance = Engine().start()
+
+    return instance
+
+
+def stop():
+    global instance
+
+    if instance is not None:
+        instance.stop()
+        instance = None
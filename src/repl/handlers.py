@@ -0,0 +1,271 @@
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, InvalidStateError, TimeoutError
+from threading import Lock
+
+from . import timer
+
+
+# The most handlers a registry holds before it starts evicting the oldest ones.
+MAX_HANDLERS = 1024
+
+# How long, in seconds, a registry holds a handler whose op hasn't had a
+# response in that time.
+HANDLER_TTL = 3600
+
+
+def is_done(response):
+    return "status" in response and "done" in response["status"]
+
+
+class BoundedDict(object):
+    """A dict that holds at most max_size items and forgets items nobody has
+    set or touched in ttl seconds.
+
+    Checks for items to forget whenever you set an item, so it never needs a
+    thread of its own. Calls on_evict with the key and the value of every item
+    it forgets."""
+
+    def __init__(self, max_size, ttl, on_evict=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.on_evict = on_evict
+        # Values are (value, last touched) tuples, least recently touched
+        # first.
+        self.items = OrderedDict()
+        self.evicted = 0
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+    def __setitem__(self, key, value):
+        self.items[key] = (value, time.monotonic())
+        self.items.move_to_end(key)
+        self.sweep()
+
+    def get(self, key, default=None):
+        item = self.items.get(key)
+        return default if item is None else item[0]
+
+    def touch(self, key):
+        item = self.items.get(key)
+
+        if item is not None:
+            self.items[key] = (item[0], time.monotonic())
+            self.items.move_to_end(key)
+
+    def pop(self, key, default=None):
+        item = self.items.pop(key, None)
+        return default if item is None else item[0]
+
+    def sweep(self):
+        deadline = time.monotonic() - self.ttl
+
+        while self.items:
+            key, (value, touched) = next(iter(self.items.items()))
+
+            if len(self.items) <= self.max_size and touched > deadline:
+                break
+
+            del self.items[key]
+            self.evicted += 1
+            self.on_evict and self.on_evict(key, value)
+
+
+class Entry(object):
+    __slots__ = (
+        "op",
+        "handler",
+        "future",
+        "responses",
+        "on_abandon",
+        "timeout",
+        "cancel_timeout",
+    )
+
+    def __init__(self, op, handler, future, on_abandon, timeout=None):
+        self.op = op
+        self.handler = handler
+        self.future = future
+        self.responses = []
+        self.on_abandon = on_abandon
+        self.timeout = timeout
+        self.cancel_timeout = None
+
+
+class Registry(object):
+    """The handlers of the ops we're waiting for responses to, keyed by op ID.
+
+    Forgets the handler of an op once the server says it's done with the op,
+    once the op times out, or once someone cancels the future of the op.
+
+    Holds at most max_size handlers and forgets handlers whose op hasn't had a
+    response in ttl seconds, unless they're persistent."""
+
+    def __init__(self, max_size=MAX_HANDLERS, ttl=HANDLER_TTL):
+        self.lock = Lock()
+        self.entries = BoundedDict(max_size, ttl, on_evict=self.on_evict)
+        self.persistent = {}
+        self.completed = 0
+        self.expired = 0
+        self.cancelled = 0
+
+    def __contains__(self, id):
+        return id in self.entries or id in self.persistent
+
+    def __len__(self):
+        return len(self.entries) + len(self.persistent)
+
+    def stats(self):
+        return {
+            "live": len(self),
+            "completed": self.completed,
+            "evicted": self.entries.evicted,
+            "expired": self.expired,
+            "cancelled": self.cancelled,
+        }
+
+    def add(
+        self,
+        id,
+        handler,
+        timeout=None,
+        future=False,
+        on_abandon=None,
+        persistent=False,
+        op=None,
+    ):
+        """Add the handler of an op.
+
+        If timeout is not None, forget the handler if the server isn't done
+        with the op in that many seconds.
+
+        If future is True, return a Future that resolves into a list of every
+        response to the op once the server is done with it. If the op times
+        out or the registry evicts its handler, the future raises a
+        concurrent.futures.TimeoutError. Cancelling the future forgets the
+        handler.
+
+        If the op times out or someone cancels its future, call on_abandon,
+        if given.
+
+        If persistent is True, never evict the handler to make room for others
+        or because the op has been quiet for a long time. Use it for ops like
+        sideloader-start that the server responds to for as long as the
+        session lives.
+
+        If given op, hold on to it, so that we can send it again if the
+        connection drops."""
+        entry = Entry(
+            op, handler, Future() if future else None, on_abandon, timeout=timeout
+        )
+
+        with self.lock:
+            if persistent:
+                self.persistent[id] = entry
+            else:
+                self.entries[id] = entry
+
+        if timeout is not None:
+            entry.cancel_timeout = timer.schedule(timeout, lambda: self.expire(id))
+
+        if entry.future:
+            entry.future.add_done_callback(
+                lambda future: future.cancelled() and self.abandon(id)
+            )
+
+        return entry.future
+
+    def get(self, id):
+        entry = self.persistent.get(id) or self.entries.get(id)
+        return entry and entry.handler
+
+    def pop(self, id):
+        """Forget the handler of an op. Return its entry, if any."""
+        with self.lock:
+            entry = self.persistent.pop(id, None) or self.entries.pop(id)
+
+        if entry and entry.cancel_timeout:
+            entry.cancel_timeout()
+
+        return entry
+
+    def clear(self):
+        """Forget every handler. Return a list of (id, entry) tuples."""
+        with self.lock:
+            entries = list(self.persistent.items())
+            entries.extend((id, item[0]) for id, item in self.entries.items.items())
+            self.persistent.clear()
+            self.entries.items.clear()
+
+        for _, entry in entries:
+            entry.cancel_timeout and entry.cancel_timeout()
+
+        return entries
+
+    def handle(self, id, response, default):
+        """Call the handler of the op with the given ID with a response.
+
+        If there's no handler for the op, call default."""
+        entry = self.persistent.get(id)
+
+        if entry is None:
+            with self.lock:
+                entry = self.entries.get(id)
+                self.entries.touch(id)
+
+        if entry is None:
+            default(response)
+            return
+
+        try:
+            entry.handler and entry.handler(response)
+        finally:
+            entry.future and entry.responses.append(response)
+            is_done(response) and self.complete(id)
+
+    def complete(self, id):
+        entry = self.pop(id)
+
+        if entry:
+            self.completed += 1
+
+            if entry.future:
+                try:
+                    entry.future.set_result(entry.responses)
+                except InvalidStateError:
+                    # Someone cancelled the future.
+                    pass
+
+    def fail(self, id, entry, message):
+        if entry.cancel_timeout:
+            entry.cancel_timeout()
+
+        if entry.future:
+            try:
+                entry.future.set_exception(TimeoutError(f"Op {id} {message}"))
+            except InvalidStateError:
+                pass
+
+    def expire(self, id):
+        entry = self.pop(id)
+
+        if entry:
+            self.expired += 1
+            self.fail(id, entry, "timed out")
+            entry.on_abandon and entry.on_abandon()
+
+    def abandon(self, id):
+        entry = self.pop(id)
+
+        if entry:
+            self.cancelled += 1
+            entry.on_abandon and entry.on_abandon()
+
+    def on_evict(self, id, entry):
+        # Called with the lock held. The op may still be running, so don't
+        # abandon it; just stop waiting for it.
+        self.fail(id, entry, "evicted")
@@ -0,0 +1,258 @@
+import time
+
+from . import capabilities
+from .handlers import is_done
+from .session import Session
+from ..log import log
+
+
+MIDDLEWARE = [
+    "tutkain.nrepl.middleware.test/wrap-test",
+    "tutkain.nrepl.middleware.tap/wrap-tap",
+]
+
+
+class Handshake(object):
+    """Sets up the sessions of a freshly connected client.
+
+    Sends every op that doesn't depend on the response to another op right
+    away instead of waiting for the previous op to finish:
+
+        describe ─┐
+        clone ────┴─ sideloader-start
+                     require pprint ─ add-middleware ─┬─ tutkain/add-tap
+                                                      └─ describe
+                     clone plugin × plugin_sessions
+                     clone user
+
+    Registers the user and plugin sessions as soon as the server has cloned
+    them and loaded the pretty-printer, and updates their info once the
+    middleware is in.
+
+    Records when each step starts and finishes. If debug is True, prints the
+    timings into the REPL view once the handshake is done.
+
+    Calls provide with the sideloader session and every sideloader lookup
+    request.
+
+    If given a capabilities.Cache that knows what the server can do once the
+    middleware is in, skips the second describe op. Otherwise, puts the
+    response to the second describe op into the cache.
+
+    Calls on_done, if given, once the handshake is done."""
+
+    def __init__(
+        self,
+        client,
+        view,
+        provide,
+        plugin_sessions=1,
+        debug=False,
+        cache=None,
+        on_done=None,
+    ):
+        self.client = client
+        self.view = view
+        self.provide = provide
+        self.plugin_sessions = max(1, plugin_sessions)
+        self.debug = debug
+        self.cache = cache
+        self.cache_key = None
+        self.on_done = on_done
+        self.started = time.monotonic()
+        # (step, started, finished) tuples, in milliseconds since the start of
+        # the handshake.
+        self.trace = []
+        self.capabilities = None
+        self.info = None
+        self.sideloader = None
+        self.printer_ready = False
+        self.clones = []
+        self.sessions = []
+        # The number of sessions to clone, and the steps that must finish,
+        # before the handshake is done. The handshake also waits for the info
+        # of the sessions.
+        self.expected_sessions = 1
+        self.expected_steps = set()
+        self.finished = False
+
+    def now(self):
+        return round((time.monotonic() - self.started) * 1000)
+
+    def send(self, sender, step, op, on_done, **kwargs):
+        """Send an op via sender, a client or a session. Once the server is done
+        with the op, record the timing of the step and call on_done with the
+        last response."""
+        started = self.now()
+
+        def handler(response):
+            if is_done(response):
+                self.trace.append((step, started, self.now()))
+                log.debug({"event": "handshake/step", "step": step})
+                on_done(response)
+
+        sender.send(op, handler=handler, **kwargs)
+
+    def start(self):
+        self.send(self.client, "describe", {"op": "describe"}, self.on_describe)
+        self.send(self.client, "clone", {"op": "clone"}, self.on_clone)
+        return self
+
+    def on_describe(self, response):
+        self.capabilities = response
+
+        if self.cache:
+            self.cache_key = capabilities.key(
+                self.client.address(),
+                response.get("versions", {}),
+                MIDDLEWARE,
+            )
+
+        self.capabilities_and_session()
+
+    def on_clone(self, response):
+        self.sideloader = Session(response["new-session"], self.client, self.view)
+        self.capabilities_and_session()
+
+    def capabilities_and_session(self):
+        if self.capabilities is None or self.sideloader is None:
+            return
+
+        session = self.sideloader
+        session.info = self.capabilities
+
+        if "sideloader-start" in self.capabilities.get("ops", {}):
+            self.client.register_session("sideloader", session)
+            self.start_sideloader(session)
+        else:
+            # Babashka
+            self.client.register_session("plugin", session)
+            session.output(self.capabilities)
+            self.printer_ready = True
+            self.info = self.capabilities
+
+            self.send(
+                self.client,
+                "clone user",
+                {"op": "clone"},
+                lambda response: self.on_clone_session("user", response),
+            )
+
+    def start_sideloader(self, sideloader):
+        self.expected_sessions = self.plugin_sessions + 1
+        self.expected_steps = {"add-tap"}
+
+        sideloader.send(
+            {"op": "sideloader-start"},
+            handler=lambda response: self.provide(sideloader, response),
+            persistent=True,
+        )
+
+        self.send(
+            sideloader,
+            "require pprint",
+            {"op": "eval", "code": """(require 'tutkain.nrepl.util.pprint)"""},
+            self.on_printer_ready,
+            pprint=False,
+        )
+
+        self.client.register_pool("plugin")
+
+        for _ in range(self.plugin_sessions):
+            self.send(
+                sideloader,
+                "clone plugin",
+                {"op": "clone", "session": sideloader.id},
+                lambda response: self.on_clone_session("plugin", response),
+            )
+
+        self.send(
+            sideloader,
+            "clone user",
+            {"op": "clone", "session": sideloader.id},
+            lambda response: self.on_clone_session("user", response),
+        )
+
+    def on_printer_ready(self, response):
+        self.printer_ready = True
+
+        self.send(
+            self.sideloader,
+            "add-middleware",
+            {"op": "add-middleware", "middleware": MIDDLEWARE},
+            self.on_middleware,
+        )
+
+        self.register_clones()
+
+    def on_middleware(self, response):
+        self.send(self.sideloader, "add-tap", {"op": "tutkain/add-tap"}, self.done)
+        cached = self.cache and self.cache.get(self.cache_key)
+
+        if cached:
+            now = self.now()
+            self.trace.append(("describe (cached)", now, now))
+            self.on_info(cached)
+        else:
+            self.send(
+                self.sideloader,
+                "describe again",
+                {"op": "describe"},
+                self.on_describe_again,
+            )
+
+    def on_describe_again(self, response):
+        self.cache and self.cache.put(self.cache_key, response)
+        self.on_info(response)
+
+    def on_info(self, response):
+        self.info = response
+        self.sideloader.info = response
+        # Session.output adds the session ID into the response, and the
+        # response may be the one in the capabilities cache.
+        self.sideloader.output(dict(response))
+
+        for session in self.sessions:
+            session.info = response
+
+        self.done()
+
+    def on_clone_session(self, owner, response):
+        session = Session(response["new-session"], self.client, self.view)
+        self.clones.append((owner, session))
+        self.register_clones()
+
+    def register_clones(self):
+        # Don't let anyone use the new sessions until they can pretty-print
+        # evaluation results.
+        if self.printer_ready:
+            clones, self.clones = self.clones, []
+
+            for owner, session in clones:
+                session.info = self.info or self.capabilities
+                self.client.register_session(owner, session)
+                self.sessions.append(session)
+
+            self.done()
+
+    def done(self, response=None):
+        steps = {step for step, _, _ in self.trace}
+
+        if (
+            not self.finished
+            and len(self.sessions) == self.expected_sessions
+            and self.expected_steps <= steps
+            and self.info is not None
+        ):
+            self.finished = True
+            log.debug({"event": "handshake/done", "trace": self.trace})
+            self.debug and self.print_trace()
+            self.on_done and self.on_done()
+
+    def print_trace(self):
+        lines = [
+            f";; {step:<16}{started:>6} ms →{finished:>6} ms\n"
+            for step, started, finished in self.trace
+        ]
+
+        self.client.recvq.put({"out": ";; Handshake\n" + "".join(lines)})
@@ -0,0 +1,102 @@
+import time
+from threading import Lock
+
+from .handlers import is_done
+from .session import Session
+
+
+class Job(object):
+    """An evaluation running in a background session."""
+
+    __slots__ = ("session", "id", "code", "ns", "started")
+
+    def __init__(self, session, code, ns):
+        self.session = session
+        # The ID of the eval op. We only know it once we've sent the op.
+        self.id = None
+        self.code = code
+        self.ns = ns
+        self.started = time.monotonic()
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def interrupt(self):
+        self.id is not None and self.session.interrupt(self.id)
+
+
+class Jobs(object):
+    """The evaluations running in the background sessions of a client, oldest
+    first."""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.jobs = []
+
+    def __iter__(self):
+        with self.lock:
+            return iter(list(self.jobs))
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def remove(self, job):
+        with self.lock:
+            if job in self.jobs:
+                self.jobs.remove(job)
+
+    def start(self, session, op, handler):
+        """Send an eval op via a background session and keep track of it until
+        the server is done with it.
+
+        Call handler with every response to the op. Return the job."""
+        job = Job(session, op["code"], op.get("ns"))
+
+        # Add the job before sending the op, in case the server is done with
+        # the op before we get to add it.
+        with self.lock:
+            self.jobs.append(job)
+
+        def on_response(response):
+            try:
+                handler(response)
+            finally:
+                is_done(response) and self.remove(job)
+
+        session.send(op, handler=on_response)
+        job.id = op["id"]
+        return job
+
+
+def background_session(client, user, callback):
+    """Call callback with an idle background session of client that prints
+    into the same view as the given user session.
+
+    If every such background session is busy, clone the user session into a
+    new one."""
+    pool = client.sessions_by_owner.get("background")
+
+    if pool is None:
+        pool = client.register_pool("background")
+
+    for session in pool:
+        if not session.handlers and session.view == user.view:
+            callback(session)
+            return
+
+    def handler(response):
+        if "new-session" in response:
+            session = Session(response["new-session"], client, user.view)
+            session.info = user.info
+            session.namespace = user.namespace
+            client.register_session("background", session)
+            callback(session)
+
+    # The response to the clone op carries the ID of the user session, so the
+    # client routes it to the user session.
+    user.send({"op": "clone"}, handler=handler)
+
+
+def format_elapsed(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes}:{seconds:02}"
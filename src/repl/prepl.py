@@ -0,0 +1,334 @@
+import re
+import uuid
+from collections import deque
+from threading import Lock
+
+from .client import Client
+from .connection import Connection
+from .session import Session
+from ..log import log
+
+
+ENCODING = "utf-8"
+
+# The form we send after the code of every op. Once the prepl has evaluated
+# it, it's done with the code that came before it.
+DONE = ":tutkain.prepl/done"
+
+# The form that tells the prepl to close the connection.
+QUIT = ":repl/quit"
+
+STRING = re.compile(r'"((?:[^"\\]|\\.)*)"')
+ESCAPE = re.compile(r"\\(u[0-9a-fA-F]{4}|.)")
+ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f"}
+TOKEN = re.compile(r"[^\s,{}\[\]()\"]+")
+WHITESPACE = re.compile(r"[\s,]*")
+
+
+def unescape(match):
+    escape = match.group(1)
+
+    if escape[0] == "u" and len(escape) == 5:
+        return chr(int(escape[1:], 16))
+
+    return ESCAPES.get(escape, escape)
+
+
+def read_scalar(line, i):
+    """Read the string, keyword, number, boolean, or nil that starts at index i
+    of line. Return the value and the index after it.
+
+    Keywords become strings without the leading colon."""
+    if line[i] == '"':
+        match = STRING.match(line, i)
+
+        if match is None:
+            raise ValueError(f"unterminated string at {i}")
+
+        return ESCAPE.sub(unescape, match.group(1)), match.end()
+
+    match = TOKEN.match(line, i)
+
+    if match is None:
+        raise ValueError(f"unexpected {line[i]!r} at {i}")
+
+    token = match.group()
+
+    if token[0] == ":":
+        value = token[1:]
+    elif token == "nil":
+        value = None
+    elif token in {"true", "false"}:
+        value = token == "true"
+    else:
+        try:
+            value = int(token)
+        except ValueError:
+            value = float(token)
+
+    return value, match.end()
+
+
+def read(line):
+    """Read an EDN map of scalars, like the ones io-prepl prints, into a dict.
+
+    Example:
+
+        >>> read('{:tag :out, :val "hi\\n"}')
+        {'tag': 'out', 'val': 'hi\\n'}
+    """
+    i = WHITESPACE.match(line).end()
+
+    if not line.startswith("{", i):
+        raise ValueError("not a map")
+
+    items = []
+    i = WHITESPACE.match(line, i + 1).end()
+
+    while not line.startswith("}", i):
+        if i >= len(line):
+            raise ValueError("unterminated map")
+
+        value, i = read_scalar(line, i)
+        items.append(value)
+        i = WHITESPACE.match(line, i).end()
+
+    if len(items) % 2:
+        raise ValueError("map with an odd number of forms")
+
+    return dict(zip(items[::2], items[1::2]))
+
+
+class Encoder(object):
+    """Writes the forms of ops into a single bytearray that it reuses for every
+    op, one form per line.
+
+    Has the same interface as bencode.Encoder, so that a Connection can use
+    either."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def clear(self):
+        del self.buffer[:]
+
+    def encode(self, op):
+        for form in op["forms"]:
+            self.buffer += form.encode(ENCODING)
+            self.buffer += b"\n"
+
+        return self.buffer
+
+
+class Decoder(object):
+    """Reads the messages a prepl sends.
+
+    io-prepl prints every message on a line of its own, so hold on to the
+    bytes after the last newline until the rest of the line arrives."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        self.buffer += data
+        end = self.buffer.rfind(b"\n")
+
+        if end == -1:
+            return
+
+        lines = self.buffer[:end].split(b"\n")
+        del self.buffer[: end + 1]
+
+        for line in lines:
+            line = line.decode(ENCODING).strip()
+
+            if line:
+                try:
+                    yield read(line)
+                except ValueError as error:
+                    log.error({"event": "prepl/read", "line": line, "error": error})
+
+
+class PreplConnection(Connection):
+    """A socket connection to a Clojure socket server that runs io-prepl."""
+
+    def __init__(self, client, address, sendq):
+        super().__init__(client, address, sendq)
+        self.encoder = Encoder()
+        self.decoder = Decoder()
+
+
+def in_ns(ns):
+    """Return a form that switches to the namespace ns, if it exists.
+
+    Unlike in-ns on its own, doesn't create an empty namespace without
+    clojure.core referred into it."""
+    return (
+        f"(clojure.core/when (clojure.core/find-ns '{ns}) (clojure.core/in-ns '{ns}))"
+    )
+
+
+def unknown_op(id, session=None):
+    response = {"id": id, "status": ["done", "unknown-op"]}
+    session and response.update(session=session)
+    return response
+
+
+class PreplSession(Session):
+    """The session of a prepl connection.
+
+    A prepl has no sessions and no ops: it evaluates every form we send, in
+    order, and sends back a message for every return value, every bit of
+    output, and every tap>. The connection therefore has a single session
+    that supports eval and load-file only and responds to every other op with
+    the unknown-op status, like nREPL does.
+
+    Turns the messages of the prepl into the responses an nREPL server would
+    send, so that the rest of the plugin doesn't have to tell the two apart."""
+
+    def __init__(self, client, view):
+        super().__init__(str(uuid.uuid4()), client, view)
+        self.info = {"ops": {"eval": {}, "load-file": {}}}
+        self.send_lock = Lock()
+        # (op ID, forms whose return value to hide) for every op the prepl
+        # isn't done with yet, oldest first. See forms.
+        self.pending = deque()
+
+    def op(self, d, pprint=True):
+        d["session"] = self.id
+        d["id"] = self.op_id()
+        self.prune(d)
+        return d
+
+    def forms(self, op):
+        """Return the forms to send to the prepl for an eval or load-file op,
+        and the forms we send on our own behalf, whose return values nobody
+        wants to see, mapped to the namespace they switch to."""
+        if op["op"] == "load-file":
+            # Like nREPL, leave the current namespace as it was.
+            hidden = {in_ns(self.namespace): self.namespace}
+            return [op["file"], *hidden, DONE], hidden
+
+        hidden = {in_ns(op["ns"]): op["ns"]} if op.get("ns") else {}
+        return [*hidden, op["code"], DONE], hidden
+
+    def send(
+        self,
+        op,
+        handler=None,
+        pprint=True,
+        timeout=None,
+        future=False,
+        persistent=False,
+    ):
+        """Send an op to the prepl.
+
+        See Session.send. The prepl can't interrupt an evaluation, so if an op
+        times out or someone cancels its future, only stop waiting for its
+        responses."""
+        if not handler and not future:
+            handler = self.client.recvq.put
+
+        with self.send_lock:
+            op = self.op(op)
+            id = op["id"]
+            result = self.handlers.add(id, handler, timeout=timeout, future=future)
+
+            if op["op"] in self.ops:
+                op["forms"], hidden = self.forms(op)
+                self.pending.append((id, hidden))
+                self.client.put(op, owner=self.owner)
+                return result
+
+        self.handlers.handle(id, unknown_op(id, self.id), self.client.recvq.put)
+        return result
+
+    def interrupt(self, id):
+        log.debug({"event": "prepl/interrupt", "id": id, "supported": False})
+
+    def handle(self, message):
+        """Handle a message from the prepl."""
+        tag = message.get("tag")
+        id, hidden = self.pending[0] if self.pending else (None, {})
+        response = {"id": id, "session": self.id} if id else {"session": self.id}
+
+        if tag == "ret":
+            form = message.get("form")
+
+            if form in hidden:
+                ns = hidden.pop(form)
+
+                if message.get("val") != "nil":
+                    return
+
+                # nREPL refuses to evaluate code in a namespace that doesn't
+                # exist, but the prepl has already read the code, so tell the
+                # user where it goes instead.
+                current = self.namespace
+                response["err"] = f"Namespace {ns} not found; staying in {current}.\n"
+            elif form == DONE:
+                self.pending.popleft()
+                response["status"] = ["done"]
+            elif message.get("exception"):
+                response["nrepl.middleware.caught/throwable"] = message["val"] + "\n"
+            else:
+                response["value"] = message["val"] + "\n"
+                "ns" in message and response.update(ns=message["ns"])
+        elif tag in {"out", "err"}:
+            response[tag] = message["val"]
+        elif tag == "tap":
+            response = {"tap": message["val"] + "\n", "session": self.id}
+        else:
+            log.debug({"event": "prepl/unknown-message", "message": message})
+            return
+
+        super().handle(response)
+
+
+class PreplClient(Client):
+    """A client for a Clojure socket server that runs io-prepl
+    (clojure.core.server/io-prepl).
+
+    Sends the code to evaluate as is, with no nREPL middleware in the way, so
+    every evaluation costs a single round trip and only a handful of
+    messages. In return, only supports evaluation, output, and tap>. See
+    PreplSession.
+
+    Uses a single connection, whatever the owners in dedicated."""
+
+    def connect(self):
+        connection = PreplConnection(self, self.address(), self.sendq)
+        self.connection = connection.connect(self.connect_timeout)
+        return self
+
+    def send(self, op, handler=None, timeout=None, future=False):
+        """Respond to an op sent outside of any session with the unknown-op
+        status. A prepl has nothing but its single session to send ops to."""
+        id = str(uuid.uuid4())
+
+        if handler is None and not future:
+            handler = self.recvq.put
+
+        result = self.handlers.add(id, handler, future=future)
+        self.handlers.handle(id, unknown_op(id), self.recvq.put)
+        return result
+
+    def handle(self, message):
+        session = self.sessions_by_owner.get("user")
+
+        if session:
+            session.handle(message)
+        else:
+            log.debug({"event": "prepl/no-session", "message": message})
+
+    def send_disconnect_notification(self, connection):
+        # The prepl closes the connection when we tell it to quit.
+        if not self.stop_event.is_set():
+            super().send_disconnect_notification(connection)
+
+    def halt(self):
+        log.debug({"event": "client/halt", "stats": self.stats()})
+        self.stop_event.set()
+
+        if self.connection and not self.connection.closed:
+            self.put({"op": "quit", "forms": [QUIT]})
@@ -0,0 +1,470 @@
+import itertools
+import queue
+import time
+from threading import Lock, RLock
+
+from ..log import log
+
+
+# How long, in seconds, a frame lasts. The printer renders at most once per
+# frame.
+FRAME = 0.016
+
+# The kind of output each key of a response carries, in order of precedence.
+KINDS = (
+    ("in", "in"),
+    ("value", "value"),
+    ("nrepl.middleware.caught/throwable", "error"),
+    ("err", "err"),
+    ("out", "out"),
+    ("summary", "test"),
+    ("status", "status"),
+)
+
+
+def kind_of(item):
+    """Return the kind of output a response carries: "in", "value", "out", and
+    so on."""
+    for key, kind in KINDS:
+        if key in item:
+            return kind
+
+    return "other"
+
+
+def take(recvq, deadline=None):
+    """Take every item in a queue. If given a deadline (a time.monotonic()
+    value), also wait for the items that arrive before the deadline.
+
+    Stop after the None that tells consumers to stop reading the queue."""
+    items = []
+
+    while True:
+        timeout = deadline and deadline - time.monotonic()
+
+        try:
+            if timeout and timeout > 0:
+                item = recvq.get(timeout=timeout)
+            else:
+                item = recvq.get_nowait()
+        except queue.Empty:
+            return items
+
+        items.append(item)
+
+        if item is None:
+            return items
+
+
+class Mailbox(queue.Queue):
+    """A queue that calls on_put when an item arrives and nobody has taken
+    the items out since the last call.
+
+    Lets a consumer take items out only once items have arrived, instead of
+    checking the queue over and over again."""
+
+    def __init__(self):
+        super().__init__()
+        self.on_put = None
+        self.pending = False
+
+    def _put(self, item):
+        super()._put(item)
+
+        # Queue.put calls _put with the mutex of the queue held.
+        if self.on_put and not self.pending:
+            self.pending = True
+            self.on_put()
+
+    def notify(self, on_put):
+        """Call on_put once now, and once again every time an item arrives
+        after the last call to take."""
+        with self.mutex:
+            self.on_put = on_put
+            self.pending = True
+
+        on_put()
+
+    def take(self):
+        """Take every item in the queue. Stop calling on_put once the None
+        that tells consumers to stop reading the queue arrives."""
+        with self.mutex:
+            self.pending = False
+
+        items = take(self)
+
+        if items and items[-1] is None:
+            with self.mutex:
+                self.on_put = None
+
+        return items
+
+
+class Output(object):
+    """The text to append into a single view."""
+
+    __slots__ = (
+        "view",
+        "chunks",
+        "length",
+        "record",
+        "record_length",
+        "regions",
+        "runs",
+        "folds",
+        "grown",
+    )
+
+    def __init__(self, view):
+        self.view = view
+        # The text to append into the view.
+        self.chunks = []
+        self.length = 0
+        # The text to append into the transcript of the view: the text to
+        # append into the view, and the text of collapsed results.
+        self.record = []
+        self.record_length = 0
+        # Lists of (begin, end) offsets into the text, by scope.
+        self.regions = {}
+        # (kind, begin, end, hidden) tuples that say what kind of output each
+        # character of the transcript text is, and whether the view hides it.
+        self.runs = []
+        # (offset into the text, fold) tuples for the folds that start in this
+        # frame.
+        self.folds = []
+        # The folds that got more lines in this frame.
+        self.grown = set()
+
+    def add_run(self, characters, kind, hidden):
+        begin = self.record_length
+        self.record.append(characters)
+        self.record_length += len(characters)
+
+        if self.runs and self.runs[-1][0] == kind and self.runs[-1][3] == hidden:
+            self.runs[-1] = (kind, self.runs[-1][1], self.record_length, hidden)
+        else:
+            self.runs.append((kind, begin, self.record_length, hidden))
+
+    def append(self, characters, scope=None, kind="other"):
+        begin = self.length
+        self.chunks.append(characters)
+        self.length += len(characters)
+        self.add_run(characters, kind, False)
+
+        if scope:
+            regions = self.regions.setdefault(scope, [])
+
+            if regions and regions[-1][1] == begin:
+                regions[-1] = (regions[-1][0], self.length)
+            else:
+                regions.append((begin, self.length))
+
+    def hide(self, characters, fold, kind="value"):
+        self.add_run(characters, kind, True)
+        self.grown.add(fold)
+
+    def fold(self, fold):
+        self.folds.append((self.length, fold))
+
+    def text(self):
+        return "".join(self.chunks)
+
+    def record_text(self):
+        return "".join(self.record)
+
+    def last_char(self):
+        return self.chunks[-1][-1] if self.chunks else None
+
+
+class Frame(object):
+    """The text to append into each view in a single frame, so that every view
+    gets a single append per frame, however many messages it has to print."""
+
+    def __init__(self):
+        # Outputs by view ID, in the order the views first got something to
+        # print.
+        self.outputs = {}
+        self.messages = 0
+
+    def output(self, view):
+        output = self.outputs.get(view.id())
+
+        if output is None:
+            output = self.outputs[view.id()] = Output(view)
+
+        return output
+
+    def append(self, view, characters, scope=None, kind="other"):
+        """Append characters of the given kind of output into the text for view.
+        If given a scope, also highlight the characters with it."""
+        if view and characters:
+            self.output(view).append(characters, scope, kind)
+
+    def hide(self, view, characters, fold, kind="value"):
+        """Put characters that view doesn't show, because they're in a fold,
+        into the transcript of view."""
+        if view and characters:
+            self.output(view).hide(characters, fold, kind)
+
+    def fold(self, view, fold):
+        """Start a fold at the end of the text for view."""
+        self.output(view).fold(fold)
+
+    def last_char(self, view):
+        """Return the last character in the text for view, or None if there's
+        no text for view in this frame."""
+        output = self.outputs.get(view.id())
+        return output and output.last_char()
+
+
+class Fold(object):
+    """The lines of a result that a view doesn't show until someone asks for
+    them."""
+
+    def __init__(self, id, view_id):
+        self.id = id
+        self.view_id = view_id
+        self.lock = Lock()
+        self.lines = []
+        # The ID of the phantom that shows how many lines the fold has.
+        self.phantom = None
+
+    def __len__(self):
+        return len(self.lines)
+
+    def extend(self, characters):
+        lines = characters.splitlines(keepends=True)
+
+        with self.lock:
+            # The previous chunk of the result may have ended in the middle of
+            # a line.
+            if self.lines and lines and not self.lines[-1].endswith("\n"):
+                self.lines[-1] += lines.pop(0)
+
+            self.lines.extend(lines)
+
+    def take(self, n):
+        """Remove the first n lines from the fold and return them."""
+        with self.lock:
+            lines = self.lines[:n]
+            del self.lines[:n]
+            return "".join(lines)
+
+
+class Folds(object):
+    """Collapses long results.
+
+    Shows the first lines of a result, up to a maximum number of lines, and
+    puts the rest into a fold. The text of a fold stays out of the view until
+    someone expands the fold.
+
+    The printer thread feeds results into the folds while the UI thread
+    expands and forgets them, so every method holds the lock."""
+
+    def __init__(self):
+        self.lock = RLock()
+        # The folds we haven't expanded all the way, by ID.
+        self.folds = {}
+        self.ids = itertools.count()
+        # The ID of the op of the current result of each view, and the number
+        # of lines of the result the view shows, by view ID.
+        self.shown = {}
+        # The fold of the current result of each view, by view ID.
+        self.open = {}
+
+    def get(self, id):
+        with self.lock:
+            return self.folds.get(id)
+
+    def feed(self, frame, view, characters, max_lines, id=None, kind="value"):
+        """Append a chunk of the result of the op with the given ID into the
+        text for view in frame. Once the result is more than max_lines lines
+        long, put the rest of the result into a fold instead.
+
+        If max_lines is 0, never collapse the result. If id is None, the chunk
+        is a result of its own."""
+        with self.lock:
+            if id is None or self.shown.get(view.id(), (id,))[0] != id:
+                self.end(view)
+
+            fold = self.open.get(view.id())
+
+            if fold is None:
+                shown = self.shown.get(view.id(), (id, 0))[1]
+
+                if not max_lines or shown + characters.count("\n") <= max_lines:
+                    self.shown[view.id()] = (id, shown + characters.count("\n"))
+                    frame.append(view, characters, kind=kind)
+                    return
+
+                lines = characters.splitlines(keepends=True)
+                rest = max_lines - shown
+                frame.append(view, "".join(lines[:rest]), kind=kind)
+                characters = "".join(lines[rest:])
+
+                fold = Fold(next(self.ids), view.id())
+                self.folds[fold.id] = fold
+                self.shown[view.id()] = (id, max_lines)
+                self.open[view.id()] = fold
+                frame.fold(view, fold)
+
+            fold.extend(characters)
+            frame.hide(view, characters, fold, kind=kind)
+
+    def end(self, view):
+        """Tell the folds the current result of view is over."""
+        with self.lock:
+            self.shown.pop(view.id(), None)
+            self.open.pop(view.id(), None)
+
+    def is_open(self, fold):
+        """Return True if the rest of the result of fold may still arrive."""
+        with self.lock:
+            return self.open.get(fold.view_id) is fold
+
+    def remove(self, fold):
+        with self.lock:
+            self.folds.pop(fold.id, None)
+
+            if self.is_open(fold):
+                self.shown.pop(fold.view_id, None)
+                self.open.pop(fold.view_id, None)
+
+    def of(self, view):
+        with self.lock:
+            return [fold for fold in self.folds.values() if fold.view_id == view.id()]
+
+    def trim(self, view, end):
+        """Forget the folds whose phantoms are in the first end characters of
+        view, which someone is about to erase, and erase their phantoms."""
+        with self.lock:
+            for fold in self.of(view):
+                if fold.phantom is not None:
+                    regions = view.query_phantom(fold.phantom)
+
+                    if not regions or regions[0].begin() < end:
+                        view.erase_phantom_by_id(fold.phantom)
+                        self.remove(fold)
+
+    def forget(self, view):
+        """Forget every fold of view."""
+        with self.lock:
+            self.end(view)
+
+            for fold in self.of(view):
+                self.remove(fold)
+
+
+class Printer(object):
+    """Renders frames and counts how many messages each render takes care
+    of."""
+
+    def __init__(self):
+        # When we last rendered a frame, in time.monotonic() seconds.
+        self.rendered = 0
+        self.stats = {"messages": 0, "renders": 0}
+
+    def next_frame(self):
+        """Return when the next frame starts."""
+        return self.rendered + FRAME
+
+    def render(self, frame, render):
+        """Call render with the Output of each view in frame."""
+        for output in frame.outputs.values():
+            render(output)
+
+        self.rendered = time.monotonic()
+
+        if frame.messages:
+            self.stats["messages"] += frame.messages
+            self.stats["renders"] += 1
+
+            log.debug(
+                {
+                    "event": "printer/render",
+                    "messages": frame.messages,
+                    "views": len(frame.outputs),
+                    "messages-per-render": self.stats["messages"]
+                    / self.stats["renders"],
+                }
+            )
+
+
+# The most ranges a single region key holds.
+MAX_RANGES_PER_KEY = 256
+
+
+class Highlights(object):
+    """Highlights the output of each stream, like stdout or stderr, in a view.
+
+    Keeps the ranges of a stream under a single region key, merging ranges
+    that touch, until the key holds MAX_RANGES_PER_KEY ranges; then starts
+    another key. Adding ranges only rewrites the newest key of the stream, so
+    the cost of printing doesn't grow with the amount of output already in the
+    view.
+
+    region is the class of the regions to add into views (sublime.Region)."""
+
+    def __init__(self, region, flags=0):
+        self.region = region
+        self.flags = flags
+        # The indices of the oldest and the newest key of each scope, by view
+        # ID.
+        self.keys = {}
+
+    def key(self, scope, index):
+        return f"{scope}.{index}"
+
+    def add(self, view, scope, ranges):
+        """Highlight (begin, end) ranges of view with scope."""
+        keys = self.keys.setdefault(view.id(), {})
+        oldest, index = keys.get(scope, (0, 0))
+        key = self.key(scope, index)
+        regions = view.get_regions(key)
+
+        for begin, end in ranges:
+            if regions and regions[-1].end() == begin:
+                regions[-1] = self.region(regions[-1].begin(), end)
+            else:
+                if len(regions) >= MAX_RANGES_PER_KEY:
+                    view.add_regions(key, regions, scope=scope, flags=self.flags)
+                    index += 1
+                    key = self.key(scope, index)
+                    regions = []
+
+                regions.append(self.region(begin, end))
+
+        keys[scope] = (oldest, index)
+        view.add_regions(key, regions, scope=scope, flags=self.flags)
+
+    def trim(self, view):
+        """Forget the ranges whose text someone has erased from the beginning
+        of view.
+
+        Sublime Text collapses the regions of erased text into empty ones, so
+        drop the empty regions from the oldest keys, and the oldest keys that
+        have nothing else left."""
+        keys = self.keys.get(view.id(), {})
+
+        for scope, (oldest, newest) in keys.items():
+            while oldest <= newest:
+                key = self.key(scope, oldest)
+                regions = view.get_regions(key)
+                kept = [region for region in regions if not region.empty()]
+
+                if kept or oldest == newest:
+                    if len(kept) < len(regions):
+                        view.add_regions(key, kept, scope=scope, flags=self.flags)
+
+                    break
+
+                view.erase_regions(key)
+                oldest += 1
+
+            keys[scope] = (oldest, newest)
+
+    def clear(self, view):
+        """Remove every highlight from view."""
+        for scope, (oldest, newest) in self.keys.pop(view.id(), {}).items():
+            for index in range(oldest, newest + 1):
+                view.erase_regions(self.key(scope, index))
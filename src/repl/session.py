@@ -1,9 +1,26 @@
 from threading import Lock
 
+from . import bencode
+from .handlers import BoundedDict, Registry, is_done
+
+# Values op() adds into every eval op, encoded into bencode ahead of time.
+PPRINT = bencode.Fragment("tutkain.nrepl.util.pprint/pprint")
+# TODO: Read wrap_width setting or the last ruler from the rulers setting?
+PPRINT_OPTIONS = bencode.Fragment({"width": 100})
+TRUE = bencode.Fragment("true")
+
+# The most error responses a session remembers, and for how many seconds.
+MAX_ERRORS = 256
+ERROR_TTL = 3600
+
 
 class Session:
     namespace = "user"
 
+    # The owner the client registered the session under: "user", "plugin",
+    # "sideloader", or "background".
+    owner = None
+
     def __init__(self, id, client, view):
         self.id = id
         self.client = client
@@ -11,11 +28,21 @@ class Session:
         self.op_count = 0
         self.lock = Lock()
         self.info = {}
-        self.handlers = {}
-        self.errors = {}
+        self.handlers = Registry()
+        self.errors = BoundedDict(MAX_ERRORS, ERROR_TTL)
+
+    @property
+    def info(self):
+        return self._info
+
+    @info.setter
+    def info(self, info):
+        self._info = info
+        # The names of the ops the server supports, for quick lookups.
+        self.ops = frozenset(info.get("ops", ()))
 
     def supports(self, key):
-        return "ops" in self.info and key in self.info["ops"]
+        return key in self.ops
 
     def op_id(self):
         with self.lock:
@@ -36,12 +63,11 @@ class Session:
 
         if d["op"] == "eval":
             if pprint:
-                d["nrepl.middleware.print/print"] = "tutkain.nrepl.util.pprint/pprint"
-                # TODO: Read wrap_width setting or the last ruler from the rulers setting?
-                d["nrepl.middleware.print/options"] = {"width": 100}
+                d["nrepl.middleware.print/print"] = PPRINT
+                d["nrepl.middleware.print/options"] = PPRINT_OPTIONS
 
-            d["nrepl.middleware.caught/print?"] = "true"
-            d["nrepl.middleware.print/stream?"] = "true"
+            d["nrepl.middleware.caught/print?"] = TRUE
+            d["nrepl.middleware.print/stream?"] = TRUE
 
         self.prune(d)
 
@@ -51,14 +77,44 @@ class Session:
         message["session"] = self.id
         self.client.recvq.put(message)
 
-    def send(self, op, handler=None, pprint=True):
+    def send(
+        self,
+        op,
+        handler=None,
+        pprint=True,
+        timeout=None,
+        future=False,
+        persistent=False,
+    ):
+        """Send an op to the server.
+
+        Call handler with every response to the op. If there's no handler and
+        future is False, put every response into the receive queue of the
+        client.
+
+        For timeout, future, and persistent, see handlers.Registry.add. If an eval op times
+        out or someone cancels its future, interrupt the evaluation."""
         op = self.op(op, pprint=pprint)
+        id = op["id"]
 
-        if not handler:
+        if not handler and not future:
             handler = self.client.recvq.put
 
-        self.handlers[op["id"]] = handler
-        self.client.sendq.put(op)
+        result = self.handlers.add(
+            id,
+            handler,
+            timeout=timeout,
+            future=future,
+            on_abandon=(lambda: self.interrupt(id)) if op["op"] == "eval" else None,
+            persistent=persistent,
+            op=op,
+        )
+
+        self.client.put(op, owner=self.owner)
+        return result
+
+    def interrupt(self, id):
+        self.send({"op": "interrupt", "interrupt-id": id}, handler=lambda _: None)
 
     def handle(self, response):
         id = response.get("id")
@@ -69,20 +125,99 @@ class Session:
         if not id:
             self.client.recvq.put(response)
         else:
-            handler = self.handlers.get(id, self.client.recvq.put)
-
             try:
-                handler.__call__(response)
+                self.handlers.handle(id, response, self.client.recvq.put)
             finally:
-                if response and "status" in response and "done" in response["status"]:
-                    self.handlers.pop(id, None)
-                    self.errors.pop(id, None)
+                if is_done(response):
+                    with self.lock:
+                        self.errors.pop(id, None)
 
     def denounce(self, response):
         id = response.get("id")
 
         if id:
-            self.errors[id] = response
+            with self.lock:
+                self.errors[id] = response
 
     def is_denounced(self, response):
         return response.get("id") in self.errors
+
+    def stats(self):
+        return {"handlers": self.handlers.stats(), "errors": len(self.errors)}
+
+
+class SessionPool:
+    """A pool of sessions that stands in for a single session.
+
+    Sends every op via the session with the fewest ops in flight, so that a
+    slow op in one session, like a long test run, doesn't hold back the ops
+    that come after it. nREPL evaluates the ops of a single session one after
+    another, but the ops of different sessions at the same time."""
+
+    def __init__(self):
+        self.sessions = []
+        self.lock = Lock()
+        self.turn = 0
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def __iter__(self):
+        return iter(list(self.sessions))
+
+    def add(self, session):
+        with self.lock:
+            self.sessions.append(session)
+
+    @property
+    def id(self):
+        return self.sessions[0].id
+
+    @property
+    def info(self):
+        return self.sessions[0].info
+
+    @property
+    def view(self):
+        return self.sessions[0].view
+
+    def supports(self, key):
+        return any(session.supports(key) for session in self.sessions)
+
+    def least_busy(self):
+        """Return the session with the fewest ops in flight.
+
+        Take turns between sessions that are equally busy."""
+        with self.lock:
+            n = len(self.sessions)
+            self.turn = (self.turn + 1) % n
+
+            return min(
+                (self.sessions[(self.turn + i) % n] for i in range(n)),
+                key=lambda session: len(session.handlers),
+            )
+
+    def send(self, op, *args, **kwargs):
+        """Send an op via the least busy session in the pool.
+
+        See Session.send."""
+        return self.least_busy().send(op, *args, **kwargs)
+
+    def output(self, message):
+        self.sessions[0].output(message)
+
+    def session(self, response):
+        for session in self.sessions:
+            if session.id == response.get("session"):
+                return session
+
+    def denounce(self, response):
+        session = self.session(response)
+        session and session.denounce(response)
+
+    def is_denounced(self, response):
+        session = self.session(response)
+        return session is not None and session.is_denounced(response)
+
+    def stats(self):
+        return [session.stats() for session in self.sessions]
@@ -0,0 +1,71 @@
+import heapq
+import itertools
+import time
+from threading import Condition, Thread
+
+from ..log import log
+
+
+class Timer(object):
+    """Calls functions after a delay, all on a single background thread.
+
+    Unlike threading.Timer, doesn't start a new thread for every call."""
+
+    def __init__(self):
+        self.condition = Condition()
+        self.queue = []
+        self.counter = itertools.count()
+        self.thread = None
+
+    def schedule(self, delay, f):
+        """Call f after delay seconds.
+
+        Return a function that cancels the call."""
+        # The counter breaks ties between entries with the same deadline, so
+        # that heapq never needs to compare functions.
+        entry = [time.monotonic() + delay, next(self.counter), f]
+
+        with self.condition:
+            heapq.heappush(self.queue, entry)
+
+            if self.thread is None:
+                self.thread = Thread(daemon=True, target=self.loop)
+                self.thread.name = "tutkain.timer"
+                self.thread.start()
+
+            self.condition.notify()
+
+        def cancel():
+            # Leave the entry in the queue; the loop skips it when its time
+            # comes.
+            entry[2] = None
+
+        return cancel
+
+    def loop(self):
+        while True:
+            with self.condition:
+                while not self.queue or self.queue[0][0] > time.monotonic():
+                    timeout = (
+                        self.queue[0][0] - time.monotonic() if self.queue else None
+                    )
+
+                    self.condition.wait(timeout)
+
+                _, _, f = heapq.heappop(self.queue)
+
+            if f is not None:
+                try:
+                    f()
+                except Exception as error:
+                    log.error({"event": "error", "error": error})
+
+
+timer = Timer()
+
+
+def schedule(delay, f):
+    """Call f after delay seconds on the shared timer thread.
+
+    Return a function that cancels the call."""
+    return timer.schedule(delay, f)
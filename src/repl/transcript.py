@@ -0,0 +1,216 @@
+import mmap
+import os
+import re
+from collections import namedtuple
+from threading import Lock
+
+from ..log import log
+
+
+ENCODING = "utf-8"
+
+# The most characters of code or of a result to show in a preview.
+PREVIEW_LENGTH = 120
+
+# A run of output of a single kind ("in", "value", "out", "err", and so on).
+#
+# offset and length are in bytes, into the transcript file. chars is where the
+# run starts in the characters the REPL view has printed.
+Entry = namedtuple("Entry", ["offset", "length", "chars", "kind"])
+
+
+class Evaluation(object):
+    """An "in" entry and the entries that come after it, up to the next "in"
+    entry."""
+
+    __slots__ = ("entries", "chars_end")
+
+    def __init__(self, entries, chars_end):
+        self.entries = entries
+        # Where the evaluation ends in the characters the REPL view has
+        # printed.
+        self.chars_end = chars_end
+
+    @property
+    def offset(self):
+        return self.entries[0].offset
+
+    @property
+    def end(self):
+        return self.entries[-1].offset + self.entries[-1].length
+
+    @property
+    def chars(self):
+        return self.entries[0].chars
+
+
+class Transcript(object):
+    """Every bit of output a REPL view prints, in a file, and an index of the
+    file.
+
+    The index file has a line for every run of output of a single kind, so
+    that we can find the evaluations in the transcript without reading the
+    transcript itself. Searching the transcript memory-maps it instead of
+    reading it into memory."""
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path + ".index"
+        self.lock = Lock()
+        # The number of characters the REPL view has printed.
+        self.chars = 0
+        # Whether appending has ever failed. If it has, the transcript is
+        # missing some of the output of the REPL view, so the view must keep
+        # all of its output.
+        self.failed = False
+
+    def append(self, text, runs):
+        """Append text into the transcript.
+
+        runs is a list of (kind, begin, end, hidden) tuples that says what kind
+        of output each character in text is, and whether the REPL view hides
+        it. Return True if appending worked."""
+        with self.lock:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+                with open(self.path, "ab") as file, open(
+                    self.index_path, "a", encoding=ENCODING
+                ) as index:
+                    offset = file.tell()
+
+                    for kind, begin, end, hidden in runs:
+                        data = text[begin:end].encode(ENCODING)
+                        file.write(data)
+                        index.write(f"{offset} {len(data)} {self.chars} {kind}\n")
+                        offset += len(data)
+
+                        if not hidden:
+                            self.chars += end - begin
+
+                return True
+            except OSError as error:
+                log.error({"event": "transcript/append", "error": error})
+                self.failed = True
+                return False
+
+    def entries(self):
+        """Yield every entry in the index, oldest first, reading the index a line
+        at a time."""
+        try:
+            with open(self.index_path, "rb") as index:
+                # Entries appended while we read belong to evaluations we
+                # might only see part of, so stop where the index ends now.
+                with self.lock:
+                    size = os.fstat(index.fileno()).st_size
+
+                position = 0
+
+                for line in index:
+                    position += len(line)
+
+                    if position > size:
+                        break
+
+                    try:
+                        offset, length, chars, kind = line.decode(ENCODING).split()
+                        yield Entry(int(offset), int(length), int(chars), kind)
+                    except ValueError:
+                        # A failed append may have left a partial line behind.
+                        log.debug(
+                            {"event": "transcript/malformed-index-line", "line": line}
+                        )
+        except OSError:
+            return
+
+    def delete(self):
+        """Delete the transcript and its index."""
+        with self.lock:
+            for path in [self.path, self.index_path]:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except OSError as error:
+                    log.error({"event": "transcript/delete", "error": error})
+
+    def evaluations(self):
+        """Yield every evaluation in the transcript, oldest first."""
+        evaluation = None
+
+        for entry in self.entries():
+            if entry.kind == "in":
+                if evaluation is not None:
+                    evaluation.chars_end = entry.chars
+                    yield evaluation
+
+                evaluation = Evaluation([entry], self.chars)
+            elif evaluation is not None:
+                evaluation.entries.append(entry)
+
+        if evaluation is not None:
+            yield evaluation
+
+    def search(self, pattern, flags=re.IGNORECASE):
+        """Return the evaluations whose code or output matches the regular
+        expression pattern, newest first."""
+        regex = re.compile(pattern.encode(ENCODING), flags)
+        evaluations = self.evaluations()
+        evaluation = next(evaluations, None)
+        found = []
+
+        if evaluation is None:
+            return found
+
+        with open(self.path, "rb") as file, mmap.mmap(
+            file.fileno(), 0, access=mmap.ACCESS_READ
+        ) as transcript:
+            position = evaluation.offset
+
+            while evaluation is not None:
+                match = regex.search(transcript, position)
+
+                if match is None:
+                    break
+
+                # Both the matches and the evaluations are in transcript order,
+                # so skip the evaluations that end before the match.
+                while evaluation is not None and evaluation.end <= match.start():
+                    evaluation = next(evaluations, None)
+
+                # The match may be in output we haven't indexed yet.
+                if evaluation is None:
+                    break
+
+                if evaluation.offset <= match.start():
+                    found.append(evaluation)
+                    # One match per evaluation is enough.
+                    position = max(evaluation.end, match.end(), match.start() + 1)
+                    evaluation = next(evaluations, None)
+                else:
+                    position = evaluation.offset
+
+        found.reverse()
+        return found
+
+    def read(self, offset, length):
+        with open(self.path, "rb") as file:
+            file.seek(offset)
+            return file.read(length).decode(ENCODING, errors="replace")
+
+    def extract(self, evaluation):
+        """Return the code and the output of an evaluation."""
+        return self.read(evaluation.offset, evaluation.end - evaluation.offset)
+
+    def preview(self, evaluation):
+        """Return the first line of the code of an evaluation and the first line
+        of its result."""
+
+        def first_line(entry):
+            text = self.read(entry.offset, min(entry.length, PREVIEW_LENGTH * 4))
+            lines = text.strip().splitlines()
+            return lines[0][:PREVIEW_LENGTH] if lines else ""
+
+        code, *output = evaluation.entries
+        results = [entry for entry in output if entry.kind in {"value", "error"}]
+        return [first_line(code), first_line(results[0]) if results else ""]
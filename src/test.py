@@ -5,6 +5,7 @@ from . import forms
 from . import namespace
 from . import sexp
 from .progress import ProgressBar
+from .repl.session import SessionPool
 
 
 progress = ProgressBar("[Tutkain] Running tests...")
@@ -120,7 +121,7 @@ def add_markers(view, session, response):
             )
 
 
-def run_tests(view, session, response, file, file_path, test_vars):
+def run_tests(view, session, output, response, file, file_path, test_vars):
     if response.get("status") == ["eval-error"]:
         progress.stop()
         session.denounce(response)
@@ -129,7 +130,7 @@ def run_tests(view, session, response, file, file_path, test_vars):
             if int(sublime.version()) >= 4073 and session.supports("tutkain/test"):
 
                 def handler(response):
-                    session.output(response)
+                    output(response)
                     add_markers(view, session, response)
                     progress.stop()
 
@@ -155,15 +156,16 @@ def run_tests(view, session, response, file, file_path, test_vars):
                      """
                         % file,
                         "file": file_path,
-                    }
+                    },
+                    handler=output,
                 )
     elif response.get("value"):
         pass
     else:
-        session.output(response)
+        output(response)
 
 
-def evaluate_view(view, session, response, test_vars):
+def evaluate_view(view, session, output, response, test_vars):
     if response.get("status") == ["done"]:
         op = {"op": "load-file", "file": view.substr(sublime.Region(0, view.size()))}
 
@@ -179,15 +181,26 @@ def evaluate_view(view, session, response, test_vars):
         session.send(
             op,
             handler=lambda response: run_tests(
-                view, session, response, file, file_path, test_vars
+                view, session, output, response, file, file_path, test_vars
             ),
         )
 
 
-def run(view, session, test_vars=[]):
+def run(view, session, test_vars=[], output=None):
+    """Run the tests in view via session.
+
+    Print the results with output, or session.output if output is None."""
     if session is None:
         view.window().status_message("ERR: Not connected to a REPL.")
     else:
+        # Without the tutkain/test op, we run the tests in the current
+        # namespace of the session that loaded the file, so send every op of
+        # the test run via the same session.
+        if isinstance(session, SessionPool):
+            session = session.least_busy()
+
+        output = output or session.output
+
         session.send(
             {
                 "op": "eval",
@@ -196,7 +209,9 @@ def run(view, session, test_vars=[]):
                              (run! (fn [[sym _]] (ns-unmap *ns* sym))))""",
                 "file": view.file_name(),
             },
-            handler=lambda response: evaluate_view(view, session, response, test_vars),
+            handler=lambda response: evaluate_view(
+                view, session, output, response, test_vars
+            ),
         )
 
         progress.start()
@@ -0,0 +1,18 @@
+import queue
+
+from Tutkain.src.repl.client import Client
+
+
+class FakeClient(Client):
+    """A client that records the ops it sends instead of sending them."""
+
+    def __init__(self):
+        super().__init__("localhost", 0, queue.Queue(), queue.Queue())
+        self.sent = []
+
+    def put(self, op, owner=None):
+        self.sent.append(op)
+
+
+def noop(response):
+    """A handler for responses no test cares about."""
@@ -1,4 +1,6 @@
+import io
 import socket
+import sys
 from threading import Event, Thread
 
 from unittest import TestCase
@@ -68,7 +70,109 @@ class TestBencode(TestCase):
             bencode.write(self.buffer, val)
             self.assertEquals(val, bencode.read(self.buffer))
 
+    def test_deeply_nested(self):
+        depth = sys.getrecursionlimit() * 2
+        val = ["leaf"]
+
+        for i in range(depth):
+            val = {"var-meta": val} if i % 2 else [i, val]
+
+        def encode(val):
+            buf = io.BytesIO()
+            bencode.write(buf, val)
+            return buf.getvalue()
+
+        # Comparing the values themselves would exceed the recursion limit, so
+        # compare their encoded forms instead.
+        data = encode(val)
+        self.assertEquals(data, encode(bencode.read(io.BytesIO(data))))
+
+        [decoded] = bencode.Decoder().feed(data)
+        self.assertEquals(data, encode(decoded))
+
     def test_invalid_byte_string(self):
         self.client.sendall(b"4spam")
         # TODO: What would be a sensible failure mode?
         self.assertRaises(socket.timeout, bencode.read, self.buffer)
+
+
+class TestEncoder(TestCase):
+    def test_fragment(self):
+        encoder = bencode.Encoder()
+        options = bencode.Fragment({"width": 100})
+
+        self.assertEquals(
+            b"d2:idi1e2:op4:eval7:optionsd5:widthi100eee",
+            encoder.encode({"op": "eval", "options": options, "id": 1}),
+        )
+
+    def test_reuse(self):
+        encoder = bencode.Encoder()
+        encoder.encode({"op": "lookup", "sym": "äö"})
+        encoder.encode([1, "a"])
+        self.assertEquals(
+            b"d2:op6:lookup3:sym4:\xc3\xa4\xc3\xb6eli1e1:ae", encoder.buffer
+        )
+        encoder.clear()
+        self.assertEquals(b"d2:op8:describee", encoder.encode({"op": "describe"}))
+
+    def test_invalid_value(self):
+        self.assertRaises(ValueError, bencode.Encoder().encode, {"op": None})
+        self.assertRaises(ValueError, bencode.Encoder().encode, {"code": b"(+ 1 2)"})
+
+
+class TestDecoder(TestCase):
+    def test_single_value(self):
+        decoder = bencode.Decoder()
+
+        self.assertEquals(
+            [{"foo": 42, "bar": "spam"}],
+            list(decoder.feed(b"d3:bar4:spam3:fooi42ee")),
+        )
+
+    def test_multiple_values_in_one_chunk(self):
+        decoder = bencode.Decoder()
+
+        self.assertEquals(
+            [42, "spam", ["eggs"], {"ham": {}}],
+            list(decoder.feed(b"i42e4:spaml4:eggsed3:hamdee")),
+        )
+
+    def test_byte_at_a_time(self):
+        decoder = bencode.Decoder()
+        data = "d2:id1:13:outl8:äöäöi-1eee".encode("utf-8")
+        values = []
+
+        for byte in data:
+            values.extend(decoder.feed(bytes([byte])))
+
+        self.assertEquals([{"id": "1", "out": ["äöäö", -1]}], values)
+
+    def test_value_split_across_chunks(self):
+        decoder = bencode.Decoder()
+        value = "x" * 100000
+        data = b"d5:value" + f"{len(value)}:{value}".encode("utf-8") + b"ei1e"
+
+        self.assertEquals([], list(decoder.feed(data[:5])))
+        self.assertEquals([], list(decoder.feed(data[5:50000])))
+        self.assertEquals([{"value": value}, 1], list(decoder.feed(data[50000:])))
+        self.assertEquals(0, len(decoder.buffer))
+
+    def test_unexpected_end(self):
+        decoder = bencode.Decoder()
+        self.assertRaises(ValueError, list, decoder.feed(b"e"))
+
+    def test_lazy_keys(self):
+        decoder = bencode.Decoder(lazy_keys=bencode.PAYLOAD_KEYS)
+        data = b"d2:id1:17:session1:s5:value4:\xc3\xa4\xc3\xb64:infod3:out1:xee"
+        [message] = decoder.feed(data)
+
+        self.assertIsInstance(message, bencode.Message)
+        self.assertEquals("1", dict.__getitem__(message, "id"))
+        self.assertEquals(bytearray("äö", "utf-8"), dict.__getitem__(message, "value"))
+        self.assertEquals("äö", message["value"])
+        self.assertEquals("äö", dict.__getitem__(message, "value"))
+        self.assertEquals("x", message["info"].get("out"))
+        self.assertEquals(
+            {"id": "1", "session": "s", "value": "äö", "info": {"out": "x"}}, message
+        )
@@ -0,0 +1,42 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from Tutkain.src.repl import capabilities
+
+
+class TestCache(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "Tutkain", "capabilities.json")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_put_and_get(self):
+        versions = {"clojure": {"version-string": "1.10.1"}}
+        key = capabilities.key(("localhost", 1234), versions)
+        cache = capabilities.Cache(self.path)
+        self.assertIsNone(cache.get(key))
+
+        cache.put(key, {"id": 1, "ops": {"eval": {"doc": "..."}}, "versions": versions})
+
+        # A new cache reads what the old one wrote.
+        self.assertEquals(
+            {"ops": {"eval": {}}, "versions": versions},
+            capabilities.Cache(self.path).get(key),
+        )
+
+    def test_key(self):
+        self.assertNotEqual(
+            capabilities.key(("localhost", 1234), {"nrepl": "0.8.2"}),
+            capabilities.key(("localhost", 1234), {"nrepl": "0.8.3"}),
+        )
+
+    def test_corrupt_file(self):
+        os.makedirs(os.path.dirname(self.path))
+
+        with open(self.path, "w") as file:
+            file.write("{")
+
+        self.assertIsNone(capabilities.Cache(self.path).get("key"))
@@ -0,0 +1,362 @@
+import os
+import queue
+import socket
+import tempfile
+from threading import Thread
+
+from unittest import TestCase
+from unittest.mock import patch
+from Tutkain.src.repl import bencode
+from Tutkain.src.repl.client import Client
+from Tutkain.src.repl.connection import MAX_BATCH_SIZE, SendQueue
+from Tutkain.src.repl.engine import Engine
+from Tutkain.src.repl.session import Session
+from Tutkain.tests.fakes import FakeClient, noop
+
+
+class Server(object):
+    """A fake nREPL server that puts every message it receives into a queue.
+
+    Call send() to send a message to the client over the first connection."""
+
+    def __init__(self, port=0, path=None):
+        if path:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.bind(path)
+        else:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.socket.bind(("localhost", port))
+
+        self.socket.listen(4)
+        self.recvq = queue.Queue()
+        self.conns = []
+        # The index of the connection the latest message of each session
+        # arrived on, by session ID.
+        self.received_on = {}
+
+    @property
+    def conn(self):
+        return self.conns[0] if self.conns else None
+
+    def port(self):
+        return self.socket.getsockname()[1]
+
+    def accept_loop(self):
+        while True:
+            try:
+                conn, _ = self.socket.accept()
+            except OSError:
+                return
+
+            self.conns.append(conn)
+            thread = Thread(
+                daemon=True, target=self.recv_loop, args=(conn, len(self.conns) - 1)
+            )
+            thread.name = "tutkain.test.server.recv_loop"
+            thread.start()
+
+    def recv_loop(self, conn, index):
+        decoder = bencode.Decoder()
+
+        while True:
+            try:
+                data = conn.recv(4096)
+            except OSError:
+                break
+
+            if not data:
+                break
+
+            for message in decoder.feed(data):
+                self.received_on[message.get("session")] = index
+                self.recvq.put(message)
+
+    def start(self):
+        thread = Thread(daemon=True, target=self.accept_loop)
+        thread.name = "tutkain.test.server"
+        thread.start()
+        return self
+
+    def recv(self):
+        return self.recvq.get(timeout=5)
+
+    def send(self, message):
+        self.conn.sendall(bencode.Encoder().encode(message))
+
+    def stop(self):
+        for conn in self.conns:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+            conn.close()
+
+        # Wake up the accept loop so that the socket actually stops
+        # listening.
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+        self.socket.close()
+
+
+class TestSendQueue(TestCase):
+    def test_priority(self):
+        q = SendQueue()
+        q.put(None)
+        q.put({"op": "eval", "id": 1})
+        q.put({"op": "completions", "id": 2})
+        q.put({"op": "load-file", "id": 3})
+        q.put({"op": "interrupt", "id": 4})
+        q.put({"op": "lookup", "id": 5})
+
+        self.assertEquals(
+            [4, 2, 5, 1, 3, None],
+            [item and item["id"] for item in (q.get() for _ in range(6))],
+        )
+
+
+class TestClient(TestCase):
+    engine = None
+
+    def setUp(self):
+        self.server = Server().start()
+        self.client = Client(
+            "localhost",
+            self.server.port(),
+            SendQueue(),
+            queue.Queue(),
+            engine=self.engine,
+        )
+
+    def tearDown(self):
+        self.client.put(None)
+        self.server.stop()
+
+    def test_send_batches_queued_ops(self):
+        for i in range(3):
+            self.client.sendq.put({"op": "eval", "code": str(i), "id": i})
+
+        self.client.go()
+
+        for i in range(3):
+            self.assertEquals(
+                {"op": "eval", "code": str(i), "id": i}, self.server.recv()
+            )
+
+        self.assertEquals({"ops": 3, "flushes": 1}, self.client.connection.stats)
+
+    def test_send_urgent_ops_first(self):
+        self.client.sendq.put({"op": "load-file", "file": "(ns foo)", "id": 1})
+        self.client.sendq.put({"op": "eval", "code": "(inc 1)", "id": 2})
+        self.client.sendq.put({"op": "completions", "prefix": "ma", "id": 3})
+        self.client.sendq.put({"op": "interrupt", "interrupt-id": 2, "id": 4})
+        self.client.go()
+
+        self.assertEquals([4, 3, 1, 2], [self.server.recv()["id"] for _ in range(4)])
+
+    def test_limit_batch_size(self):
+        for i in range(3):
+            self.client.sendq.put({"op": "eval", "code": "x" * MAX_BATCH_SIZE, "id": i})
+
+        self.client.go()
+
+        for i in range(3):
+            self.assertEquals(i, self.server.recv()["id"])
+
+        self.assertEquals({"ops": 3, "flushes": 3}, self.client.connection.stats)
+
+    def test_nodelay(self):
+        self.client.go()
+        self.assertTrue(
+            self.client.connection.socket.getsockopt(
+                socket.IPPROTO_TCP, socket.TCP_NODELAY
+            )
+        )
+
+    def test_handle(self):
+        self.client.go()
+        responses = queue.Queue()
+        self.client.send({"op": "describe"}, handler=responses.put)
+        op = self.server.recv()
+        self.server.send({"id": op["id"], "ops": {"eval": {}}, "status": ["done"]})
+
+        self.assertEquals(
+            {"id": op["id"], "ops": {"eval": {}}, "status": ["done"]},
+            responses.get(timeout=5),
+        )
+
+    def test_future(self):
+        self.client.go()
+        future = self.client.send({"op": "describe"}, future=True)
+        op = self.server.recv()
+        self.server.send({"id": op["id"], "ops": {}})
+        self.server.send({"id": op["id"], "status": ["done"]})
+
+        self.assertEquals(
+            [{"id": op["id"], "ops": {}}, {"id": op["id"], "status": ["done"]}],
+            future.result(timeout=5),
+        )
+
+        self.assertNotIn(op["id"], self.client.handlers)
+
+    def test_dedicated_connection(self):
+        self.client.dedicated = ("plugin",)
+        self.client.go()
+        user = self.client.register_session("user", Session("u", self.client, None))
+        plugin = self.client.register_session("plugin", Session("p", self.client, None))
+
+        user.send({"op": "eval", "code": "(Thread/sleep 1000)"}, handler=noop)
+        plugin.send({"op": "completions", "prefix": "ma"}, handler=noop)
+        self.server.recv()
+        self.server.recv()
+
+        self.assertNotEqual(self.server.received_on["u"], self.server.received_on["p"])
+
+    def test_reconnect(self):
+        self.client.reconnect = True
+        self.client.go()
+        self.client.register_session("plugin", Session("p1", self.client, None))
+        self.client.register_session("user", Session("u1", self.client, None))
+        responses = queue.Queue()
+
+        self.client.sessions_by_owner["plugin"].send(
+            {"op": "lookup", "sym": "map"}, handler=responses.put
+        )
+
+        self.client.sessions_by_owner["user"].send(
+            {"op": "eval", "code": "(inc 1)"}, future=True
+        )
+
+        self.assertEquals("lookup", self.server.recv()["op"])
+        self.assertEquals("eval", self.server.recv()["op"])
+
+        def on_reconnect(client):
+            client.register_session("plugin", Session("p2", client, None))
+
+        self.client.on_reconnect = on_reconnect
+
+        port = self.server.port()
+        self.server.stop()
+        self.server = Server(port).start()
+
+        # Send the lookup op again, via the new plugin session, but not the
+        # eval op.
+        op = self.server.recv()
+        self.assertEquals(
+            {"op": "lookup", "sym": "map", "session": "p2"},
+            {k: v for k, v in op.items() if k != "id"},
+        )
+
+        self.server.send({"id": op["id"], "session": "p2", "status": ["done"]})
+        self.assertEquals("p2", responses.get(timeout=5)["session"])
+
+    def test_replay_future(self):
+        self.client.reconnect = True
+        self.client.go()
+        plugin = Session("p1", self.client, None)
+        self.client.register_session("plugin", plugin)
+        responses = queue.Queue()
+
+        future = plugin.send(
+            {"op": "lookup", "sym": "map"},
+            handler=responses.put,
+            timeout=60,
+            future=True,
+        )
+
+        self.server.recv()
+
+        def on_reconnect(client):
+            client.register_session("plugin", Session("p2", client, None))
+
+        self.client.on_reconnect = on_reconnect
+
+        port = self.server.port()
+        self.server.stop()
+        self.server = Server(port).start()
+
+        op = self.server.recv()
+        entry = self.client.sessions_by_owner["plugin"].handlers.entries.get(op["id"])
+        self.assertEquals(60, entry.timeout)
+
+        response = {"id": op["id"], "session": "p2", "status": ["done"]}
+        self.server.send(response)
+        self.assertEquals([response], future.result(timeout=5))
+        self.assertEquals(response, responses.get(timeout=5))
+
+    @patch("Tutkain.src.repl.client.RECONNECT_ATTEMPTS", 1)
+    def test_reconnect_fails(self):
+        self.client.reconnect = True
+        self.client.go()
+        self.server.stop()
+
+        self.assertEquals(
+            ":tutkain/reconnect-failed\n", self.client.recvq.get(timeout=5)["value"]
+        )
+
+
+class TestClone(TestCase):
+    def test_clone(self):
+        client = FakeClient()
+        sideloader = client.register_session("sideloader", Session("s", client, None))
+        responses = []
+
+        for session in [sideloader, None]:
+            client.clone(responses.append, session=session)
+            op = client.sent[-1]
+            self.assertEquals("clone", op["op"])
+
+            # nREPL responds in the session of the op, if any.
+            response = {"id": op["id"], "new-session": "n", "status": ["done"]}
+            "session" in op and response.update(session=op["session"])
+            client.handle(response)
+
+        self.assertEquals(["s", None], [r.get("session") for r in responses])
+        self.assertTrue(client.recvq.empty())
+
+
+class TestUnixSocketClient(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, ".nrepl-socket")
+        self.server = Server(path=self.path).start()
+        self.client = Client(None, None, SendQueue(), queue.Queue(), path=self.path)
+
+    def tearDown(self):
+        self.client.put(None)
+        self.server.stop()
+        self.dir.cleanup()
+
+    def test_handle(self):
+        self.client.go()
+        self.assertEquals(self.path, self.client.address())
+        responses = queue.Queue()
+        self.client.send({"op": "describe"}, handler=responses.put)
+        op = self.server.recv()
+        self.server.send({"id": op["id"], "status": ["done"]})
+
+        self.assertEquals(
+            {"id": op["id"], "status": ["done"]}, responses.get(timeout=5)
+        )
+
+
+class TestClientWithEngine(TestClient):
+    @classmethod
+    def setUpClass(self):
+        self.engine = Engine().start()
+
+    @classmethod
+    def tearDownClass(self):
+        self.engine.stop()
+
+    def test_disconnect(self):
+        self.client.go()
+        self.client.send({"op": "describe"})
+        self.server.recv()
+        self.server.stop()
+        self.assertIsNone(self.client.recvq.get(timeout=5))
+        self.assertTrue(self.client.connection.closed)
@@ -0,0 +1,98 @@
+from concurrent.futures import TimeoutError
+from unittest import TestCase
+
+from Tutkain.src.repl.handlers import Registry
+
+
+class TestRegistry(TestCase):
+    def test_handle(self):
+        registry = Registry()
+        responses = []
+        unhandled = []
+        registry.add(1, responses.append)
+
+        registry.handle(1, {"id": 1, "value": "1"}, unhandled.append)
+        self.assertIn(1, registry)
+        registry.handle(1, {"id": 1, "status": ["done"]}, unhandled.append)
+        self.assertNotIn(1, registry)
+        registry.handle(1, {"id": 1, "value": "2"}, unhandled.append)
+
+        self.assertEquals(
+            [{"id": 1, "value": "1"}, {"id": 1, "status": ["done"]}], responses
+        )
+
+        self.assertEquals([{"id": 1, "value": "2"}], unhandled)
+
+    def test_future(self):
+        registry = Registry()
+        future = registry.add(1, None, future=True)
+        registry.handle(1, {"id": 1, "value": "1"}, None)
+        self.assertFalse(future.done())
+        registry.handle(1, {"id": 1, "status": ["done"]}, None)
+
+        self.assertEquals(
+            [{"id": 1, "value": "1"}, {"id": 1, "status": ["done"]}],
+            future.result(timeout=1),
+        )
+
+    def test_timeout(self):
+        registry = Registry()
+        abandoned = []
+        future = registry.add(
+            1, None, timeout=0.01, future=True, on_abandon=lambda: abandoned.append(1)
+        )
+
+        self.assertRaises(TimeoutError, future.result, timeout=1)
+        self.assertNotIn(1, registry)
+        self.assertEquals([1], abandoned)
+
+    def test_cancel(self):
+        registry = Registry()
+        abandoned = []
+        future = registry.add(
+            1, None, future=True, on_abandon=lambda: abandoned.append(1)
+        )
+
+        self.assertTrue(future.cancel())
+        self.assertNotIn(1, registry)
+        self.assertEquals([1], abandoned)
+
+        # Responses that arrive after cancellation go to the default handler.
+        unhandled = []
+        registry.handle(1, {"id": 1, "status": ["done"]}, unhandled.append)
+        self.assertEquals([{"id": 1, "status": ["done"]}], unhandled)
+
+    def test_max_size(self):
+        registry = Registry(max_size=2)
+        future = registry.add(1, None, future=True)
+        registry.add(2, None)
+        registry.add(3, None, persistent=True)
+        registry.add(4, None)
+
+        self.assertNotIn(1, registry)
+        self.assertIn(2, registry)
+        self.assertIn(3, registry)
+        self.assertIn(4, registry)
+        self.assertRaises(TimeoutError, future.result, timeout=1)
+
+    def test_ttl(self):
+        registry = Registry(ttl=0)
+        registry.add(1, None)
+        registry.add(2, None, persistent=True)
+        registry.add(3, None)
+
+        self.assertNotIn(1, registry)
+        self.assertIn(2, registry)
+
+    def test_stats(self):
+        registry = Registry(max_size=1)
+        registry.add(1, None)
+        registry.add(2, None)
+        registry.add(3, None, future=True).cancel()
+        registry.add(4, None)
+        registry.handle(4, {"id": 4, "status": ["done"]}, None)
+
+        self.assertEquals(
+            {"live": 0, "completed": 1, "evicted": 2, "expired": 0, "cancelled": 1},
+            registry.stats(),
+        )
@@ -0,0 +1,136 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from Tutkain.src.repl.capabilities import Cache
+
+from Tutkain.src.repl.handshake import Handshake
+from Tutkain.tests.fakes import FakeClient
+
+
+class TestHandshake(TestCase):
+    def setUp(self):
+        self.client = FakeClient()
+        self.provided = []
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def provide(self, session, response):
+        self.provided.append(response)
+
+    def ops(self):
+        sent, self.client.sent = self.client.sent, []
+        return sent
+
+    def respond(self, op, **response):
+        response["id"] = op["id"]
+        "session" in op and response.setdefault("session", op["session"])
+        response["status"] = ["done"]
+        self.client.handle(response)
+
+    def test_sideloader(self):
+        handshake = Handshake(
+            self.client, None, self.provide, plugin_sessions=2
+        ).start()
+
+        describe, clone = self.ops()
+        self.assertEquals(["describe", "clone"], [describe["op"], clone["op"]])
+
+        self.respond(describe, ops={"sideloader-start": {}, "eval": {}})
+        self.assertEquals([], self.ops())
+        self.respond(clone, **{"new-session": "s"})
+
+        start, require, *clones = self.ops()
+        self.assertEquals("sideloader-start", start["op"])
+        self.assertEquals("eval", require["op"])
+        self.assertEquals(["clone"] * 3, [op["op"] for op in clones])
+
+        for i, op in enumerate(clones):
+            self.respond(op, **{"new-session": f"c{i}"})
+
+        # The sessions can't pretty-print yet.
+        self.assertNotIn("user", self.client.sessions_by_owner)
+
+        self.respond(require)
+        self.assertEquals("c2", self.client.sessions_by_owner["user"].id)
+        self.assertEquals(
+            ["c0", "c1"], [s.id for s in self.client.sessions_by_owner["plugin"]]
+        )
+
+        (middleware,) = self.ops()
+        self.assertEquals("add-middleware", middleware["op"])
+        self.respond(middleware)
+
+        tap, describe = self.ops()
+        self.assertEquals(["tutkain/add-tap", "describe"], [tap["op"], describe["op"]])
+        self.respond(tap)
+        self.assertFalse(handshake.finished)
+        self.respond(describe, ops={"tutkain/test": {}})
+
+        self.assertTrue(handshake.finished)
+        self.assertTrue(self.client.sessions_by_owner["user"].supports("tutkain/test"))
+
+        self.assertEquals(
+            [
+                "describe",
+                "clone",
+                "clone plugin",
+                "clone plugin",
+                "clone user",
+                "require pprint",
+                "add-middleware",
+                "add-tap",
+                "describe again",
+            ],
+            [step for step, _, _ in handshake.trace],
+        )
+
+    def test_cache(self):
+        cache = Cache(os.path.join(self.dir.name, "capabilities.json"))
+
+        for cached in [False, True]:
+            self.client = FakeClient()
+            handshake = Handshake(self.client, None, self.provide, cache=cache).start()
+            describe, clone = self.ops()
+            self.respond(describe, ops={"sideloader-start": {}}, versions={"n": 1})
+            self.respond(clone, **{"new-session": "s"})
+
+            _, require, *clones = self.ops()
+
+            for i, op in enumerate(clones):
+                self.respond(op, **{"new-session": f"c{i}"})
+
+            self.respond(require)
+            self.respond(self.ops()[0])
+
+            if cached:
+                (tap,) = self.ops()
+            else:
+                tap, describe = self.ops()
+                self.respond(describe, ops={"sideloader-start": {}, "tutkain/test": {}})
+
+            self.respond(tap)
+            self.assertTrue(handshake.finished)
+            self.assertTrue(
+                self.client.sessions_by_owner["user"].supports("tutkain/test")
+            )
+
+            self.assertNotIn("session", cache.get(handshake.cache_key))
+
+    def test_babashka(self):
+        handshake = Handshake(self.client, None, self.provide, debug=True).start()
+        describe, clone = self.ops()
+        self.respond(clone, **{"new-session": "p"})
+        self.respond(describe, ops={"eval": {}})
+        self.assertEquals("p", self.client.sessions_by_owner["plugin"].id)
+
+        (clone,) = self.ops()
+        self.respond(clone, **{"new-session": "u"})
+        self.assertEquals("u", self.client.sessions_by_owner["user"].id)
+        self.assertTrue(handshake.finished)
+
+        # In debug mode, print the timings of every step.
+        items = list(self.client.recvq.queue)
+        self.assertTrue(items[-1]["out"].startswith(";; Handshake\n"))
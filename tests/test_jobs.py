@@ -0,0 +1,82 @@
+from unittest import TestCase
+
+from Tutkain.src.repl import jobs
+from Tutkain.src.repl.session import Session
+from Tutkain.tests.fakes import FakeClient, noop
+
+
+class TestJobs(TestCase):
+    def setUp(self):
+        self.client = FakeClient()
+        self.user = self.client.register_session(
+            "user", Session("user", self.client, None)
+        )
+
+    def respond(self, op, **response):
+        # Like nREPL, echo the session of the op.
+        response.update(id=op["id"], session=op["session"], status=["done"])
+        self.client.handle(response)
+
+    def test_start(self):
+        session = Session("a", self.client, None)
+        responses = []
+        job = self.client.jobs.start(
+            session,
+            {"op": "eval", "code": "(load-data)", "ns": "user"},
+            responses.append,
+        )
+
+        self.assertEquals([job], list(self.client.jobs))
+
+        job.interrupt()
+        self.assertEquals(
+            {"op": "interrupt", "interrupt-id": job.id, "session": "a"},
+            {k: v for k, v in self.client.sent[-1].items() if k != "id"},
+        )
+
+        session.handle({"id": job.id, "session": "a", "status": ["done"]})
+        self.assertEquals([], list(self.client.jobs))
+        self.assertEquals(
+            [{"id": job.id, "session": "a", "status": ["done"]}], responses
+        )
+
+    def test_background_session(self):
+        sessions = []
+        jobs.background_session(self.client, self.user, sessions.append)
+
+        clone = self.client.sent[-1]
+        self.assertEquals("clone", clone["op"])
+        self.assertEquals("user", clone["session"])
+
+        self.respond(clone, **{"new-session": "b"})
+        self.assertEquals(["b"], [session.id for session in sessions])
+
+        # Reuse the background session while it's idle.
+        jobs.background_session(self.client, self.user, sessions.append)
+        self.assertEquals(["b", "b"], [session.id for session in sessions])
+
+        # Clone a new one while it's busy.
+        sessions[0].send({"op": "eval", "code": "(load-data)"}, handler=noop)
+        jobs.background_session(self.client, self.user, sessions.append)
+        self.assertEquals("clone", self.client.sent[-1]["op"])
+
+    def test_background_session_per_view(self):
+        other = self.client.add_session("user", Session("other", self.client, 2))
+        sessions = []
+        jobs.background_session(self.client, self.user, sessions.append)
+        clone = self.client.sent[-1]
+        self.respond(clone, **{"new-session": "b"})
+
+        # Don't reuse the background session of another view.
+        jobs.background_session(self.client, other, sessions.append)
+        clone = self.client.sent[-1]
+        self.assertEquals(
+            {"op": "clone", "session": "other"},
+            {k: clone[k] for k in ["op", "session"]},
+        )
+        self.respond(clone, **{"new-session": "c"})
+        self.assertEquals([None, 2], [session.view for session in sessions])
+
+    def test_format_elapsed(self):
+        self.assertEquals("0:07", jobs.format_elapsed(7.5))
+        self.assertEquals("2:05", jobs.format_elapsed(125))
@@ -0,0 +1,170 @@
+import queue
+from unittest import TestCase
+
+from Tutkain.src.repl import prepl
+
+
+class FakeClient(prepl.PreplClient):
+    """A prepl client that records the ops it sends instead of sending them."""
+
+    def __init__(self):
+        super().__init__("localhost", 0, queue.Queue(), queue.Queue())
+        self.sent = []
+
+    def put(self, op, owner=None):
+        self.sent.append(op)
+
+
+class TestRead(TestCase):
+    def test_read(self):
+        self.assertEquals(
+            {
+                "tag": "ret",
+                "val": '{:a "b"}',
+                "ns": "user",
+                "ms": 3,
+                "form": '(hash-map :a "b")',
+            },
+            prepl.read(
+                r'{:tag :ret, :val "{:a \"b\"}", :ns "user", :ms 3, '
+                r':form "(hash-map :a \"b\")"}'
+            ),
+        )
+
+    def test_read_scalars(self):
+        self.assertEquals(
+            {"a": None, "b": True, "c": False, "d": 1.5, "e": "x\ny\\ä"},
+            prepl.read(r'{:a nil :b true :c false :d 1.5 :e "x\ny\\ä"}'),
+        )
+
+    def test_read_invalid(self):
+        for line in ["[1 2]", '{:a "b}', "{:a 1", "{:a}"]:
+            with self.assertRaises(ValueError):
+                prepl.read(line)
+
+
+class TestDecoder(TestCase):
+    def test_feed(self):
+        decoder = prepl.Decoder()
+
+        self.assertEquals(
+            [{"tag": "out", "val": "a"}],
+            list(decoder.feed(b'{:tag :out, :val "a"}\n{:tag')),
+        )
+
+        self.assertEquals([], list(decoder.feed(b' :out, :val "\xc3')))
+
+        self.assertEquals(
+            [{"tag": "out", "val": "\u00e4"}],
+            list(decoder.feed(b'\xa4"}\n\nnot edn\n')),
+        )
+
+
+class TestPreplSession(TestCase):
+    def setUp(self):
+        self.client = FakeClient()
+        self.session = prepl.PreplSession(self.client, None)
+        self.client.register_session("user", self.session)
+        self.responses = []
+
+    def send(self, op):
+        self.session.send(op, handler=self.responses.append)
+        return self.client.sent[-1]
+
+    def test_eval(self):
+        op = self.send({"op": "eval", "code": '(println "hi") (inc 1)', "ns": "foo"})
+
+        self.assertEquals(
+            [prepl.in_ns("foo"), '(println "hi") (inc 1)', prepl.DONE],
+            op["forms"],
+        )
+
+        for message in [
+            {
+                "tag": "ret",
+                "val": '#object[clojure.lang.Namespace 0x1 "foo"]',
+                "ns": "foo",
+                "form": prepl.in_ns("foo"),
+            },
+            {"tag": "out", "val": "hi\n"},
+            {"tag": "ret", "val": "nil", "ns": "foo", "form": '(println "hi")'},
+            {"tag": "ret", "val": "2", "ns": "foo", "form": "(inc 1)"},
+            {"tag": "ret", "val": prepl.DONE, "ns": "foo", "form": prepl.DONE},
+        ]:
+            self.client.handle(message)
+
+        id, session = op["id"], self.session.id
+
+        self.assertEquals(
+            [
+                {"id": id, "session": session, "out": "hi\n"},
+                {"id": id, "session": session, "value": "nil\n", "ns": "foo"},
+                {"id": id, "session": session, "value": "2\n", "ns": "foo"},
+                {"id": id, "session": session, "status": ["done"]},
+            ],
+            self.responses,
+        )
+
+        self.assertEquals("foo", self.session.namespace)
+        self.assertEquals(0, len(self.session.handlers))
+
+    def test_namespace_not_found(self):
+        op = self.send({"op": "eval", "code": "(inc 1)", "ns": "foo"})
+        self.client.handle(
+            {"tag": "ret", "val": "nil", "ns": "user", "form": prepl.in_ns("foo")}
+        )
+
+        self.assertEquals(
+            [
+                {
+                    "id": op["id"],
+                    "session": self.session.id,
+                    "err": "Namespace foo not found; staying in user.\n",
+                }
+            ],
+            self.responses,
+        )
+
+    def test_exception(self):
+        op = self.send({"op": "eval", "code": "(/ 1 0)"})
+        self.client.handle(
+            {"tag": "ret", "val": "{:cause 1}", "exception": True, "form": "(/ 1 0)"}
+        )
+
+        self.assertEquals(
+            [
+                {
+                    "id": op["id"],
+                    "session": self.session.id,
+                    "nrepl.middleware.caught/throwable": "{:cause 1}\n",
+                }
+            ],
+            self.responses,
+        )
+
+    def test_load_file(self):
+        op = self.send({"op": "load-file", "file": "(ns bar)"})
+
+        self.assertEquals(["(ns bar)", prepl.in_ns("user"), prepl.DONE], op["forms"])
+
+    def test_unknown_op(self):
+        self.send({"op": "eval", "code": "1"})
+        self.send({"op": "completions", "prefix": "ma"})
+        future = self.session.send({"op": "interrupt"}, future=True)
+
+        self.assertEquals(1, len(self.client.sent))
+        self.assertEquals(["done", "unknown-op"], self.responses[-1]["status"])
+        self.assertEquals(["done", "unknown-op"], future.result(timeout=1)[0]["status"])
+
+    def test_tap(self):
+        self.client.handle({"tag": "tap", "val": "{:a 1}"})
+
+        self.assertEquals(
+            {"tap": "{:a 1}\n", "session": self.session.id},
+            self.client.recvq.get_nowait(),
+        )
+
+    def test_halt(self):
+        self.client.connection = None
+        self.client.halt()
+        self.assertTrue(self.client.stop_event.is_set())
@@ -0,0 +1,342 @@
+import queue
+import time
+from threading import Thread, Timer
+from unittest import TestCase
+from unittest.mock import patch
+
+from Tutkain.src.repl import printer
+
+
+class View(object):
+    def __init__(self, id):
+        self.view_id = id
+
+    def id(self):
+        return self.view_id
+
+
+class TestTake(TestCase):
+    def test_take(self):
+        q = queue.Queue()
+        q.put(1)
+        q.put(2)
+
+        self.assertEquals([1, 2], printer.take(q))
+        self.assertEquals([], printer.take(q))
+
+    def test_stop(self):
+        q = queue.Queue()
+
+        for item in [1, None, 2]:
+            q.put(item)
+
+        self.assertEquals([1, None], printer.take(q))
+
+    def test_deadline(self):
+        q = queue.Queue()
+        Timer(0.01, lambda: q.put(1)).start()
+
+        self.assertEquals([1], printer.take(q, time.monotonic() + 0.1))
+
+
+class TestMailbox(TestCase):
+    def test_notify(self):
+        mailbox = printer.Mailbox()
+        calls = []
+
+        mailbox.put(1)
+        mailbox.notify(lambda: calls.append(len(calls)))
+        self.assertEquals([0], calls)
+
+        # Nobody has taken the items out yet.
+        mailbox.put(2)
+        self.assertEquals([0], calls)
+
+        self.assertEquals([1, 2], mailbox.take())
+        self.assertEquals([], mailbox.take())
+        self.assertEquals([0], calls)
+
+        mailbox.put(3)
+        mailbox.put(None)
+        self.assertEquals([0, 1], calls)
+        self.assertEquals([3, None], mailbox.take())
+
+        # Once stopped, stop calling.
+        mailbox.put(4)
+        self.assertEquals([0, 1], calls)
+
+
+class TestKind(TestCase):
+    def test_kind_of(self):
+        self.assertEquals("in", printer.kind_of({"in": "(inc 1)", "ns": "user"}))
+        self.assertEquals("value", printer.kind_of({"value": "2", "ns": "user"}))
+        self.assertEquals("err", printer.kind_of({"err": "boom"}))
+        self.assertEquals("other", printer.kind_of({}))
+
+
+class TestFrame(TestCase):
+    def test_append(self):
+        frame = printer.Frame()
+        a, b = View(1), View(2)
+
+        frame.append(a, "a\n", scope="stdout", kind="out")
+        frame.append(b, None)
+        frame.append(a, "b\n", scope="stdout", kind="out")
+        frame.append(b, "c\n", scope="stderr", kind="err")
+        frame.append(a, "1\n", kind="value")
+        frame.append(a, "d\n", scope="stdout", kind="out")
+        frame.append(None, "e\n")
+
+        self.assertIsNone(printer.Frame().last_char(a))
+        self.assertEquals("\n", frame.last_char(a))
+
+        rendered = []
+        p = printer.Printer()
+        frame.messages = 7
+        p.render(
+            frame,
+            lambda output: rendered.append(
+                (output.view, output.text(), output.regions, output.runs)
+            ),
+        )
+
+        self.assertEquals(
+            [
+                (
+                    a,
+                    "a\nb\n1\nd\n",
+                    {"stdout": [(0, 4), (6, 8)]},
+                    [
+                        ("out", 0, 4, False),
+                        ("value", 4, 6, False),
+                        ("out", 6, 8, False),
+                    ],
+                ),
+                (b, "c\n", {"stderr": [(0, 2)]}, [("err", 0, 2, False)]),
+            ],
+            rendered,
+        )
+
+        self.assertEquals({"messages": 7, "renders": 1}, p.stats)
+
+
+class PhantomView(View):
+    def __init__(self, id):
+        super().__init__(id)
+        self.phantoms = {}
+
+    def add_phantom(self, point):
+        id = len(self.phantoms) + 1
+        self.phantoms[id] = point
+        return id
+
+    def query_phantom(self, id):
+        return [Region(self.phantoms[id], self.phantoms[id])]
+
+    def erase_phantom_by_id(self, id):
+        del self.phantoms[id]
+
+
+class TestFolds(TestCase):
+    def test_feed(self):
+        folds = printer.Folds()
+        view = View(1)
+        frame = printer.Frame()
+
+        folds.feed(frame, view, "(0\n1\n", 3, id="1")
+        folds.feed(frame, view, "2\n3\n4", 3, id="1")
+        output = frame.outputs[1]
+
+        self.assertEquals("(0\n1\n2\n", output.text())
+        self.assertEquals("(0\n1\n2\n3\n4", output.record_text())
+        self.assertEquals(
+            [("value", 0, 7, False), ("value", 7, 10, True)],
+            output.runs,
+        )
+
+        [(offset, fold)] = output.folds
+        self.assertEquals(7, offset)
+        self.assertEquals({fold}, output.grown)
+        self.assertTrue(folds.is_open(fold))
+
+        # The next chunk finishes the last line of the fold.
+        frame = printer.Frame()
+        folds.feed(frame, view, "5)\n", 3, id="1")
+        self.assertEquals("", frame.outputs[1].text())
+        self.assertEquals({fold}, frame.outputs[1].grown)
+        self.assertEquals(["3\n", "45)\n"], fold.lines)
+
+        self.assertEquals("3\n", fold.take(1))
+        self.assertEquals(1, len(fold))
+        self.assertIs(fold, folds.get(fold.id))
+
+        # The result of another op starts anew.
+        folds.feed(frame, view, "nil\n", 3, id="2")
+        self.assertEquals("nil\n", frame.outputs[1].text())
+        self.assertFalse(folds.is_open(fold))
+
+        folds.forget(view)
+        self.assertIsNone(folds.get(fold.id))
+
+    def test_remove_from_threads(self):
+        folds = printer.Folds()
+        view = View(1)
+
+        def feed():
+            for i in range(1000):
+                folds.feed(printer.Frame(), view, "1\n2\n", 1, id=str(i))
+
+        thread = Thread(target=feed)
+        thread.start()
+
+        while thread.is_alive():
+            for fold in folds.of(view):
+                folds.remove(fold)
+                folds.remove(fold)
+
+        thread.join()
+        folds.forget(view)
+        self.assertEquals([], folds.of(view))
+
+    def test_trim(self):
+        folds = printer.Folds()
+        view = PhantomView(1)
+        frame = printer.Frame()
+
+        folds.feed(frame, view, "1\n2\n", 1, id="1")
+        folds.feed(frame, view, "3\n4\n", 1, id="2")
+        (_, old), (_, new) = frame.outputs[1].folds
+        old.phantom = view.add_phantom(1)
+        new.phantom = view.add_phantom(3)
+
+        folds.trim(view, 2)
+
+        self.assertIsNone(folds.get(old.id))
+        self.assertIs(new, folds.get(new.id))
+        self.assertEquals({new.phantom: 3}, view.phantoms)
+
+    def test_no_limit(self):
+        folds = printer.Folds()
+        view = View(1)
+        frame = printer.Frame()
+
+        folds.feed(frame, view, "1\n2\n3\n", 0)
+        folds.feed(frame, view, "4\n", 2)
+
+        self.assertEquals("1\n2\n3\n4\n", frame.outputs[1].text())
+        self.assertEquals([], frame.outputs[1].folds)
+
+    def test_end(self):
+        folds = printer.Folds()
+        view = View(1)
+        frame = printer.Frame()
+
+        folds.feed(frame, view, "1\n", 2, id="1")
+        folds.end(view)
+        folds.feed(frame, view, "2\n3\n", 2, id="1")
+
+        self.assertEquals("1\n2\n3\n", frame.outputs[1].text())
+
+
+class Region(object):
+    def __init__(self, a, b):
+        self.a = a
+        self.b = b
+
+    def begin(self):
+        return self.a
+
+    def end(self):
+        return self.b
+
+    def empty(self):
+        return self.a == self.b
+
+    def __eq__(self, other):
+        return (self.a, self.b) == (other.a, other.b)
+
+    def __repr__(self):
+        return f"Region({self.a}, {self.b})"
+
+
+class RegionView(View):
+    def __init__(self, id):
+        super().__init__(id)
+        self.regions = {}
+        self.writes = 0
+
+    def get_regions(self, key):
+        return list(self.regions.get(key, []))
+
+    def add_regions(self, key, regions, scope="", flags=0):
+        self.writes += 1
+        self.regions[key] = list(regions)
+
+    def erase_regions(self, key):
+        self.regions.pop(key, None)
+
+
+class TestHighlights(TestCase):
+    def test_merge(self):
+        view = RegionView(1)
+        highlights = printer.Highlights(Region)
+
+        highlights.add(view, "stdout", [(0, 2), (4, 6)])
+        highlights.add(view, "stdout", [(6, 8)])
+        highlights.add(view, "stderr", [(8, 9)])
+
+        self.assertEquals(
+            {
+                "stdout.0": [Region(0, 2), Region(4, 8)],
+                "stderr.0": [Region(8, 9)],
+            },
+            view.regions,
+        )
+
+        highlights.clear(view)
+        self.assertEquals({}, view.regions)
+
+    @patch("Tutkain.src.repl.printer.MAX_RANGES_PER_KEY", 2)
+    def test_start_new_key(self):
+        view = RegionView(1)
+        highlights = printer.Highlights(Region)
+
+        for i in range(5):
+            highlights.add(view, "stdout", [(i * 2, i * 2 + 1)])
+
+        self.assertEquals(
+            {
+                "stdout.0": [Region(0, 1), Region(2, 3)],
+                "stdout.1": [Region(4, 5), Region(6, 7)],
+                "stdout.2": [Region(8, 9)],
+            },
+            view.regions,
+        )
+
+        # One write per add, and one more for every full key.
+        self.assertEquals(7, view.writes)
+
+    @patch("Tutkain.src.repl.printer.MAX_RANGES_PER_KEY", 2)
+    def test_trim(self):
+        view = RegionView(1)
+        highlights = printer.Highlights(Region)
+
+        for i in range(5):
+            highlights.add(view, "stdout", [(i * 2, i * 2 + 1)])
+
+        # Erase the first five characters.
+        view.regions = {
+            "stdout.0": [Region(0, 0), Region(0, 0)],
+            "stdout.1": [Region(0, 0), Region(1, 2)],
+            "stdout.2": [Region(3, 4)],
+        }
+
+        highlights.trim(view)
+
+        self.assertEquals(
+            {"stdout.1": [Region(1, 2)], "stdout.2": [Region(3, 4)]},
+            view.regions,
+        )
+
+        highlights.clear(view)
+        self.assertEquals({}, view.regions)
@@ -0,0 +1,36 @@
+from unittest import TestCase
+
+from Tutkain.src.repl.session import Session, SessionPool
+from Tutkain.tests.fakes import FakeClient, noop
+
+
+class TestSessionPool(TestCase):
+    def setUp(self):
+        self.client = FakeClient()
+        self.pool = SessionPool()
+
+        for id in ["a", "b"]:
+            self.pool.add(Session(id, self.client, None))
+
+    def test_send_via_least_busy(self):
+        self.pool.send({"op": "eval", "code": "(run-tests)"}, handler=noop)
+        self.pool.send({"op": "completions", "prefix": "m"}, handler=noop)
+        self.pool.send({"op": "lookup", "sym": "map"}, handler=noop)
+
+        first, second, third = self.client.sent
+        self.assertNotEqual(first["session"], second["session"])
+
+        # Once the second op is done, its session is the least busy again.
+        session = self.pool.session(second)
+        session.handle({"id": second["id"], "status": ["done"]})
+        self.pool.send({"op": "lookup", "sym": "filter"}, handler=noop)
+        self.assertEquals(second["session"], self.client.sent[-1]["session"])
+
+    def test_denounce(self):
+        response = {"id": 1, "session": "b", "err": "Boom!"}
+        self.pool.denounce(response)
+        self.assertTrue(self.pool.is_denounced(response))
+        self.assertFalse(self.pool.is_denounced({"id": 1, "session": "a"}))
+
+    def test_empty(self):
+        self.assertFalse(SessionPool())
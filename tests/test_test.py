@@ -1,6 +1,8 @@
 from functools import partial
+from .fakes import FakeClient
 from .util import ViewTestCase
 from Tutkain.src import test
+from Tutkain.src.repl.session import Session, SessionPool
 
 
 class TestTest(ViewTestCase):
@@ -21,3 +23,24 @@ class TestTest(ViewTestCase):
         self.assertEquals("bar", test.current(self.view, 7))
         self.assertEquals("bar", test.current(self.view, 26))
         self.assertEquals(None, test.current(self.view, 27))
+
+    def test_run_via_one_session(self):
+        client = FakeClient()
+        pool = SessionPool()
+
+        for id in ["a", "b"]:
+            pool.add(Session(id, client, self.view))
+
+        self.set_view_content("(ns foo.bar-test)")
+        test.run(self.view, pool)
+
+        # Unmap the old tests, load the file, and run the tests.
+        for op in ["eval", "load-file", "eval"]:
+            sent = client.sent[-1]
+            self.assertEquals(op, sent["op"])
+            pool.session(sent).handle(
+                {"id": sent["id"], "session": sent["session"], "status": ["done"]}
+            )
+
+        self.assertEquals(1, len({op["session"] for op in client.sent}))
+        test.progress.stop()
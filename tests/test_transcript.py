@@ -0,0 +1,132 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from Tutkain.src.repl.transcript import Entry, Transcript
+
+
+class TestTranscript(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        path = os.path.join(self.dir.name, "transcripts", "a.txt")
+        self.transcript = Transcript(path)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def append(self, *chunks, hidden=False):
+        """Append (kind, text) chunks into the transcript in one go."""
+        text = ""
+        runs = []
+
+        for kind, chunk in chunks:
+            runs.append((kind, len(text), len(text) + len(chunk), hidden))
+            text += chunk
+
+        self.assertTrue(self.transcript.append(text, runs))
+
+    def test_append(self):
+        self.append(("out", "nREPL 0.8.3\n"), ("in", 'user=> (str "ä")\n'))
+        self.append(("value", '"ä"\n'))
+
+        self.assertEquals(
+            [
+                Entry(0, 12, 0, "out"),
+                Entry(12, 18, 12, "in"),
+                Entry(30, 5, 29, "value"),
+            ],
+            list(self.transcript.entries()),
+        )
+
+        self.assertEquals(33, self.transcript.chars)
+
+    def test_append_hidden(self):
+        self.append(("in", "user=> (range 3)\n"), ("value", "(0\n"))
+        self.append(("value", "1\n2)\n"), hidden=True)
+        self.append(("in", "user=> (inc 1)\n"))
+
+        self.assertEquals(
+            [
+                Entry(0, 17, 0, "in"),
+                Entry(17, 3, 17, "value"),
+                Entry(20, 5, 20, "value"),
+                Entry(25, 15, 20, "in"),
+            ],
+            list(self.transcript.entries()),
+        )
+
+        self.assertEquals(35, self.transcript.chars)
+        first, second = self.transcript.evaluations()
+        self.assertEquals(
+            "user=> (range 3)\n(0\n1\n2)\n", self.transcript.extract(first)
+        )
+
+    def test_append_fails(self):
+        transcript = Transcript(self.dir.name)
+        self.assertFalse(transcript.failed)
+        self.assertFalse(transcript.append("x", [("out", 0, 1, False)]))
+        self.assertTrue(transcript.failed)
+
+    def test_malformed_index_line(self):
+        self.append(("in", "user=> (inc 1)\n"), ("value", "2\n"))
+
+        with open(self.transcript.index_path, "a") as index:
+            index.write("17 2")
+
+        self.assertEquals(
+            [Entry(0, 15, 0, "in"), Entry(15, 2, 15, "value")],
+            list(self.transcript.entries()),
+        )
+
+    def test_delete(self):
+        self.append(("in", "user=> (inc 1)\n"))
+        self.transcript.delete()
+        self.transcript.delete()
+
+        self.assertFalse(os.path.exists(self.transcript.path))
+        self.assertFalse(os.path.exists(self.transcript.index_path))
+
+    def test_search(self):
+        self.append(("in", "user=> (range 3)\n"), ("value", "(0 1 2)\n"))
+        self.append(("in", "user=> (println :a)\n"), ("out", ":a\n"))
+        self.append(("value", "nil\n"))
+        self.append(("in", "user=> (inc 1)\n"), ("value", "2\n"))
+
+        first, second, third = self.transcript.evaluations()
+        self.assertEquals(third.chars, second.chars_end)
+        self.assertEquals(self.transcript.chars, third.chars_end)
+
+        def search(pattern):
+            return [e.offset for e in self.transcript.search(pattern)]
+
+        self.assertEquals([third.offset, first.offset], search(r"\(\w+ \d\)"))
+        self.assertEquals([second.offset], search(":A"))
+        self.assertEquals([], search("nope"))
+
+        self.assertEquals(
+            "user=> (println :a)\n:a\nnil\n", self.transcript.extract(second)
+        )
+
+        self.assertEquals(
+            ["user=> (println :a)", "nil"], self.transcript.preview(second)
+        )
+
+    def test_search_empty(self):
+        self.assertEquals([], self.transcript.search("x"))
+
+    def test_search_output_before_evaluations(self):
+        self.append(("out", "match\n"))
+        self.append(("in", "user=> (inc 1)\n"), ("value", "2\n"))
+        self.append(("in", "user=> :match\n"), ("value", ":match\n"))
+
+        first, second = self.transcript.evaluations()
+        self.assertEquals(
+            [second.offset], [e.offset for e in self.transcript.search("match")]
+        )
+
+    def test_entries_appended_while_reading(self):
+        self.append(("in", "user=> (inc 1)\n"), ("value", "2\n"))
+        entries = self.transcript.entries()
+        self.assertEquals(Entry(0, 15, 0, "in"), next(entries))
+        self.append(("in", "user=> (inc 2)\n"))
+        self.assertEquals([Entry(15, 2, 15, "value")], list(entries))